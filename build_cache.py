@@ -0,0 +1,359 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+## On-disk cache of built TFTF and FFFF files (and key headers)
+#
+# create-tftf, sign-tftf, create-ffff and pem2arakeys can look up their
+# output in a BuildCache before building it, and store it there afterwards.
+# Entries are keyed by a BuildKey: a digest of the tool, the tool sources,
+# the build parameters, the contents of every input file and
+# SOURCE_DATE_EPOCH (see: util.get_timestamp).
+#
+# NB. Without SOURCE_DATE_EPOCH, a cache hit returns the earlier build,
+# complete with its timestamp.
+#
+# sign-tftf can also use a SignatureCache, which maps the digest of a
+# TFTF's signable blob and the signing key to the signature, so that
+# re-signing identical content doesn't need the private key. Unlike the
+# BuildCache, it is kept to a maximum size by discarding the least
+# recently used signatures.
+
+from __future__ import print_function
+import os
+import hashlib
+import shutil
+import tempfile
+from struct import pack
+from signature_common import TFTF_SIGNATURE_LENGTHS
+from util import warning
+
+# Environment variable naming the default cache directory
+BUILD_CACHE_ENV = "BOOTROM_TOOLS_CACHE"
+
+# Environment variable naming the default signature cache directory, and
+# the default maximum size of a signature cache
+SIGNATURE_CACHE_ENV = "BOOTROM_TOOLS_SIGNATURE_CACHE"
+SIGNATURE_CACHE_SIZE_DEFAULT = 16 * 1024 * 1024
+
+# Size of the blob to hash each time
+hash_blob_size = 1024 * 1024
+
+# Digest of the tool sources (see: get_tools_digest)
+tools_digest = None
+
+
+def get_tools_digest():
+    """Return a digest of the bootrom-tools sources
+
+    This is part of every BuildKey, so that changing the tools invalidates
+    anything they built.
+    """
+    global tools_digest
+    if not tools_digest:
+        tools_dir = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(tools_dir)):
+            pathname = os.path.join(tools_dir, name)
+            # Modules and executable scripts
+            if name.endswith(".py") or \
+               ("." not in name and os.path.isfile(pathname) and
+                    os.access(pathname, os.X_OK)):
+                with open(pathname, 'rb') as source:
+                    digest.update(name.encode("utf-8"))
+                    digest.update(source.read())
+        tools_digest = digest.hexdigest()
+    return tools_digest
+
+
+class BuildKey(object):
+    """Digest of everything which determines a build's output"""
+
+    def __init__(self, tool, params):
+        """Constructor
+
+        tool is the name of the building tool, and params is a dictionary
+        of the parameters (e.g., command-line args) which affect the output.
+        """
+        self.digest = hashlib.sha256()
+        self.add_data(tool.encode("utf-8"))
+        self.add_data(get_tools_digest().encode("utf-8"))
+        self.add_data(os.environ.get("SOURCE_DATE_EPOCH", "").encode("utf-8"))
+        self.add_data(repr(sorted(params.items())).encode("utf-8"))
+
+    def add_data(self, data):
+        """Add a blob to the key"""
+        self.digest.update(pack("<Q", len(data)))
+        self.digest.update(data)
+
+    def add_params(self, params):
+        """Add a (per-input) dictionary of parameters to the key"""
+        self.add_data(repr(sorted(params.items())).encode("utf-8"))
+
+    def add_file(self, filename, offset=0, length=None):
+        """Add the contents of a file (or part of it) to the key
+
+        Raises IOError if the file can't be read.
+        """
+        with open(filename, 'rb') as readfile:
+            readfile.seek(offset)
+            if length is None:
+                length = os.fstat(readfile.fileno()).st_size - offset
+            self.digest.update(pack("<Q", length))
+            while length > 0:
+                blob = readfile.read(min(length, hash_blob_size))
+                if not blob:
+                    raise IOError("{0:s} is truncated".format(filename))
+                self.digest.update(blob)
+                length -= len(blob)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+class BuildCache(object):
+    """On-disk cache of built files, indexed by BuildKey"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def entry_name(self, key):
+        # Return the pathname of a cache entry
+        digest = key.hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest[2:])
+
+    def fetch(self, key, filename):
+        """Copy a cached build to filename, returning True if there was one"""
+        entry_name = self.entry_name(key)
+        if not os.path.isfile(entry_name):
+            return False
+        try:
+            copy_file(entry_name, filename)
+            return True
+        except (IOError, OSError) as e:
+            warning("Unable to use cached build for", filename, "-", e)
+            return False
+
+    def store(self, key, filename):
+        """Add a build to the cache
+
+        Failures are not fatal (the cache is just an optimization).
+        """
+        try:
+            copy_file(filename, self.entry_name(key))
+        except (IOError, OSError) as e:
+            warning("Unable to cache", filename, "-", e)
+
+    def fetch_data(self, key):
+        """Return a cached build's contents, or None if there isn't one"""
+        try:
+            with open(self.entry_name(key), 'rb') as rf:
+                return rf.read()
+        except (IOError, OSError):
+            return None
+
+    def store_data(self, key, data):
+        """Add a build's contents (e.g., a generated header) to the cache
+
+        Failures are not fatal (the cache is just an optimization).
+        """
+        try:
+            write_file(self.entry_name(key), data)
+        except (IOError, OSError) as e:
+            warning("Unable to cache build -", e)
+
+
+class SignatureCache(object):
+    """On-disk LRU cache of signatures, indexed by digest and key"""
+
+    def __init__(self, cache_dir, max_size=SIGNATURE_CACHE_SIZE_DEFAULT):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def entry_name(self, digest, key_id, key_name, signature_algorithm):
+        # Return the pathname of a cache entry
+        #
+        # digest is the digest of the signable blob, key_id identifies the
+        # key itself (e.g., a digest of the key file), and key_name and
+        # signature_algorithm are as recorded in the signature block.
+        entry_digest = hashlib.sha256()
+        for item in (digest, key_id, key_name, str(signature_algorithm)):
+            if not isinstance(item, bytes):
+                item = item.encode("utf-8")
+            entry_digest.update(pack("<Q", len(item)))
+            entry_digest.update(item)
+        entry_digest = entry_digest.hexdigest()
+        return os.path.join(self.cache_dir, entry_digest[:2],
+                            entry_digest[2:])
+
+    def fetch(self, digest, key_id, key_name, signature_algorithm,
+              check=None):
+        """Return a cached signature, or None if there isn't one
+
+        An entry which isn't a signature of the algorithm's length, or
+        which is rejected by check (an optional function taking the
+        signature and returning True if it's valid), is discarded.
+        """
+        entry_name = self.entry_name(digest, key_id, key_name,
+                                     signature_algorithm)
+        try:
+            with open(entry_name, 'rb') as rf:
+                signature = rf.read()
+        except (IOError, OSError):
+            return None
+        length = TFTF_SIGNATURE_LENGTHS.get(signature_algorithm)
+        if not signature or (length and len(signature) != length) or \
+           (check and not check(signature)):
+            warning("Discarding bad cached signature", entry_name)
+            try:
+                os.remove(entry_name)
+            except OSError:
+                pass
+            return None
+        # Mark it as recently used
+        try:
+            os.utime(entry_name, None)
+        except OSError:
+            pass
+        return signature
+
+    def store(self, digest, key_id, key_name, signature_algorithm,
+              signature):
+        """Add a signature to the cache
+
+        Failures are not fatal (the cache is just an optimization).
+        """
+        entry_name = self.entry_name(digest, key_id, key_name,
+                                     signature_algorithm)
+        try:
+            write_file(entry_name, signature)
+        except (IOError, OSError) as e:
+            warning("Unable to cache signature -", e)
+
+    def prune(self):
+        """Discard the least recently used signatures to fit max_size"""
+        entries = []
+        total_size = 0
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                pathname = os.path.join(dirpath, filename)
+                try:
+                    statinfo = os.stat(pathname)
+                except OSError:
+                    continue
+                entries.append((statinfo.st_mtime, pathname,
+                                statinfo.st_size))
+                total_size += statinfo.st_size
+        entries.sort()
+        for _, pathname, size in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(pathname)
+            except OSError:
+                pass
+            total_size -= size
+
+
+def write_file(dst, data):
+    # Atomically write a file (see: copy_file)
+    dst_dir = os.path.dirname(os.path.abspath(dst))
+    make_dirs(dst_dir)
+    fd, temp_name = tempfile.mkstemp(dir=dst_dir)
+    try:
+        with os.fdopen(fd, 'wb') as wf:
+            wf.write(data)
+        set_default_mode(temp_name)
+        os.rename(temp_name, dst)
+    except:
+        os.remove(temp_name)
+        raise
+
+
+def set_default_mode(filename):
+    # Give a file created by mkstemp (which makes it private to us) the
+    # permissions of an ordinary new file, so that cache entries can be
+    # shared no matter which path wrote them.
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(filename, 0o666 & ~umask)
+
+
+def make_dirs(dirname):
+    # Create a directory (and its parents) if needed
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # (Someone else may have just created it)
+            if not os.path.isdir(dirname):
+                raise
+
+
+def copy_file(src, dst):
+    # Atomically copy a file, creating the destination directory if needed,
+    # so that concurrent builds never see a partial file.
+    dst_dir = os.path.dirname(os.path.abspath(dst))
+    make_dirs(dst_dir)
+    fd, temp_name = tempfile.mkstemp(dir=dst_dir)
+    try:
+        with os.fdopen(fd, 'wb') as wf:
+            with open(src, 'rb') as rf:
+                shutil.copyfileobj(rf, wf, hash_blob_size)
+        set_default_mode(temp_name)
+        os.rename(temp_name, dst)
+    except:
+        os.remove(temp_name)
+        raise
+
+
+def get_build_cache(cache_dir=None):
+    """Return the BuildCache to use, if any
+
+    The cache is used if cache_dir (e.g., a "--cache" argument) is given,
+    or the BOOTROM_TOOLS_CACHE environment variable is set.
+    """
+    cache_dir = cache_dir or os.environ.get(BUILD_CACHE_ENV)
+    if cache_dir:
+        return BuildCache(cache_dir)
+    return None
+
+
+def get_signature_cache(cache_dir=None,
+                        max_size=SIGNATURE_CACHE_SIZE_DEFAULT):
+    """Return the SignatureCache to use, if any
+
+    The cache is used if cache_dir (e.g., a "--signature-cache" argument)
+    is given, or the BOOTROM_TOOLS_SIGNATURE_CACHE environment variable is
+    set.
+    """
+    cache_dir = cache_dir or os.environ.get(SIGNATURE_CACHE_ENV)
+    if cache_dir:
+        return SignatureCache(cache_dir, max_size)
+    return None
@@ -0,0 +1,331 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+## Crypto backends
+#
+# The signing and verification tools use RSA keys and message digests
+# through a CryptoBackend, so that they can run on either M2Crypto or the
+# "cryptography" package (with hashlib for the digests), whichever is
+# installed or faster on the build host (see: benchmark-crypto).
+#
+# The backend is chosen by name with --crypto, or by the BOOTROM_TOOLS_CRYPTO
+# environment variable, or else is the first one available of
+# crypto_backend_names.
+#
+# Both packages are slow to import, so a backend's package is only imported
+# when it is first asked for a digest or a key (see: import_m2crypto,
+# import_cryptography), which may be never (e.g., if every signature is
+# cached).
+
+from __future__ import print_function
+import os
+import binascii
+import hashlib
+
+# The backends' packages, once imported
+M2Crypto = None
+InvalidSignature = default_backend = hashes = serialization = None
+padding = rsa = utils = None
+
+# Environment variable naming the default backend
+CRYPTO_BACKEND_ENV = "BOOTROM_TOOLS_CRYPTO"
+
+CRYPTO_BACKEND_M2CRYPTO = "m2crypto"
+CRYPTO_BACKEND_CRYPTOGRAPHY = "cryptography"
+
+# Backend names, in order of preference
+crypto_backend_names = (CRYPTO_BACKEND_M2CRYPTO, CRYPTO_BACKEND_CRYPTOGRAPHY)
+
+# RSA public exponent for generated keys
+RSA_PUBLIC_EXPONENT = 65537
+
+
+class CryptoError(Exception):
+    """A key can't be loaded (e.g., a wrong passphrase) or used"""
+    pass
+
+
+def is_installed(module_name):
+    # Determine if a (top-level) module can be imported, without importing
+    # it
+    try:
+        from importlib.util import find_spec
+    except ImportError:
+        # (Python 2)
+        import imp
+        try:
+            imp.find_module(module_name)
+            return True
+        except ImportError:
+            return False
+    return find_spec(module_name) is not None
+
+
+def import_m2crypto():
+    # Import M2Crypto, if it hasn't been already
+    global M2Crypto
+    if M2Crypto is None:
+        import M2Crypto
+
+
+def import_cryptography():
+    # Import the parts of cryptography we use, if they haven't been already
+    global InvalidSignature, default_backend, hashes, serialization, \
+        padding, rsa, utils
+    if default_backend is None:
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import padding, rsa, \
+            utils
+        from cryptography.hazmat.backends import default_backend
+
+
+def int_to_bytes(value):
+    # Convert a non-negative integer to big-endian bytes
+    hex_value = "{0:x}".format(value)
+    if len(hex_value) % 2:
+        hex_value = "0" + hex_value
+    return binascii.unhexlify(hex_value)
+
+
+class PublicKey(object):
+    """An RSA public key (backend-independent part)"""
+
+    def fingerprint(self):
+        """Return a fingerprint of the key (a digest of its modulus)"""
+        return hashlib.sha256(int_to_bytes(self.modulus())).hexdigest()
+
+
+class M2CryptoPrivateKey(object):
+    """An RSA private key, held by M2Crypto"""
+
+    def __init__(self, key):
+        self.key = key
+
+    def sign(self, digest, hash_algorithm):
+        """Sign a digest (PKCS#1 v1.5), returning the signature"""
+        try:
+            return self.key.sign(digest, hash_algorithm)
+        except M2Crypto.RSA.RSAError as e:
+            raise CryptoError(str(e))
+
+    def public_key(self):
+        return M2CryptoPublicKey(M2Crypto.RSA.new_pub_key(self.key.pub()))
+
+
+class M2CryptoPublicKey(PublicKey):
+    """An RSA public key, held by M2Crypto"""
+
+    def __init__(self, key):
+        self.key = key
+
+    def verify(self, digest, signature, hash_algorithm):
+        """Check a signature of a digest, returning True if it's valid"""
+        try:
+            return bool(self.key.verify(digest, signature, hash_algorithm))
+        except M2Crypto.RSA.RSAError:
+            return False
+
+    def modulus(self):
+        # (M2Crypto returns the modulus as an OpenSSL MPI: a 4-byte length
+        # followed by the big-endian value)
+        return int(binascii.hexlify(self.key.n[4:]), 16)
+
+    def exponent(self):
+        return int(binascii.hexlify(self.key.e[4:]), 16)
+
+
+class M2CryptoBackend(object):
+    """Crypto backend using M2Crypto"""
+
+    name = CRYPTO_BACKEND_M2CRYPTO
+
+    def new_digest(self, hash_algorithm):
+        """Return a new digest object (with update and digest methods)"""
+        import_m2crypto()
+        return M2Crypto.EVP.MessageDigest(hash_algorithm)
+
+    def load_private_key(self, filename, passphrase=None):
+        """Load a PEM private key, raising CryptoError if it can't be"""
+        import_m2crypto()
+        try:
+            return M2CryptoPrivateKey(M2Crypto.RSA.load_key(
+                filename, lambda *unused: passphrase or ""))
+        except (M2Crypto.RSA.RSAError, M2Crypto.BIO.BIOError) as e:
+            raise CryptoError(str(e))
+
+    def load_public_key(self, filename):
+        """Load a PEM public key, raising CryptoError if it can't be"""
+        import_m2crypto()
+        try:
+            return M2CryptoPublicKey(M2Crypto.RSA.load_pub_key(filename))
+        except (M2Crypto.RSA.RSAError, M2Crypto.BIO.BIOError) as e:
+            raise CryptoError(str(e))
+
+    def generate_private_key(self, bits):
+        """Generate an RSA private key (e.g., for benchmarking)"""
+        import_m2crypto()
+        return M2CryptoPrivateKey(M2Crypto.RSA.gen_key(
+            bits, RSA_PUBLIC_EXPONENT, lambda *unused: None))
+
+
+class CryptographyPrivateKey(object):
+    """An RSA private key, held by cryptography"""
+
+    def __init__(self, key):
+        self.key = key
+
+    def sign(self, digest, hash_algorithm):
+        """Sign a digest (PKCS#1 v1.5), returning the signature"""
+        return self.key.sign(digest, padding.PKCS1v15(),
+                             get_prehashed(hash_algorithm))
+
+    def public_key(self):
+        return CryptographyPublicKey(self.key.public_key())
+
+
+class CryptographyPublicKey(PublicKey):
+    """An RSA public key, held by cryptography"""
+
+    def __init__(self, key):
+        self.key = key
+
+    def verify(self, digest, signature, hash_algorithm):
+        """Check a signature of a digest, returning True if it's valid"""
+        try:
+            self.key.verify(bytes(signature), digest, padding.PKCS1v15(),
+                            get_prehashed(hash_algorithm))
+            return True
+        except InvalidSignature:
+            return False
+
+    def modulus(self):
+        return self.key.public_numbers().n
+
+    def exponent(self):
+        return self.key.public_numbers().e
+
+
+def get_prehashed(hash_algorithm):
+    # Return the cryptography signature algorithm for a precomputed digest
+    try:
+        return utils.Prehashed(getattr(hashes, hash_algorithm.upper())())
+    except AttributeError:
+        raise CryptoError("Unknown hash algorithm {0}".format(hash_algorithm))
+
+
+class CryptographyBackend(object):
+    """Crypto backend using cryptography, with hashlib digests"""
+
+    name = CRYPTO_BACKEND_CRYPTOGRAPHY
+
+    def new_digest(self, hash_algorithm):
+        """Return a new digest object (with update and digest methods)"""
+        return hashlib.new(hash_algorithm)
+
+    def load_private_key(self, filename, passphrase=None):
+        """Load a PEM private key, raising CryptoError if it can't be"""
+        import_cryptography()
+        try:
+            with open(filename, 'rb') as rf:
+                pem = rf.read()
+            if passphrase is not None and not isinstance(passphrase, bytes):
+                passphrase = passphrase.encode("utf-8")
+            try:
+                key = serialization.load_pem_private_key(pem, None,
+                                                         default_backend())
+            except TypeError:
+                # (The key is encrypted)
+                key = serialization.load_pem_private_key(pem, passphrase,
+                                                         default_backend())
+        except (IOError, ValueError, TypeError) as e:
+            raise CryptoError(str(e))
+        if not isinstance(key, rsa.RSAPrivateKey):
+            raise CryptoError("{0} is not an RSA key".format(filename))
+        return CryptographyPrivateKey(key)
+
+    def load_public_key(self, filename):
+        """Load a PEM public key, raising CryptoError if it can't be"""
+        import_cryptography()
+        try:
+            with open(filename, 'rb') as rf:
+                key = serialization.load_pem_public_key(rf.read(),
+                                                        default_backend())
+        except (IOError, ValueError) as e:
+            raise CryptoError(str(e))
+        if not isinstance(key, rsa.RSAPublicKey):
+            raise CryptoError("{0} is not an RSA key".format(filename))
+        return CryptographyPublicKey(key)
+
+    def generate_private_key(self, bits):
+        """Generate an RSA private key (e.g., for benchmarking)"""
+        import_cryptography()
+        return CryptographyPrivateKey(rsa.generate_private_key(
+            RSA_PUBLIC_EXPONENT, bits, default_backend()))
+
+
+# Backend classes (and the package each needs), by name
+crypto_backends = {
+    CRYPTO_BACKEND_M2CRYPTO: (M2CryptoBackend, "M2Crypto"),
+    CRYPTO_BACKEND_CRYPTOGRAPHY: (CryptographyBackend, "cryptography"),
+}
+
+
+def available_crypto_backends():
+    """Return the names of the backends which are installed"""
+    return [name for name in crypto_backend_names
+            if is_installed(crypto_backends[name][1])]
+
+
+def get_crypto_backend(name=None):
+    """Return a CryptoBackend
+
+    name is the backend name (e.g., a "--crypto" argument). If it's not
+    given, the BOOTROM_TOOLS_CRYPTO environment variable is used, and if
+    that's not set, the first available backend. Raises CryptoError if the
+    backend is unknown or not installed.
+    """
+    name = name or os.environ.get(CRYPTO_BACKEND_ENV)
+    if not name:
+        available = available_crypto_backends()
+        if not available:
+            raise CryptoError("No crypto backend is installed (needs one "
+                              "of: {0})".format(", ".join(
+                                  crypto_backend_names)))
+        name = available[0]
+    if name not in crypto_backends:
+        raise CryptoError("Unknown crypto backend '{0}' (must be one of: "
+                          "{1})".format(name, ", ".join(crypto_backend_names)))
+    backend_class, package = crypto_backends[name]
+    if not is_installed(package):
+        raise CryptoError("The {0} crypto backend is not installed".
+                          format(name))
+    return backend_class()
@@ -29,27 +29,27 @@
 #
 
 from __future__ import print_function
-from time import gmtime, strftime
-from struct import unpack_from, pack_into
+from struct import pack_into
 from ffff_element import FFFF_HDR_VALID, \
-    FFFF_MAX_HEADER_BLOCK_SIZE, FFFF_HDR_OFF_TAIL_SENTINEL, \
-    FFFF_HDR_OFF_ELEMENT_TBL, FFFF_HDR_NUM_ELEMENTS, FfffElement, \
+    FFFF_MAX_HEADER_BLOCK_SIZE, FfffElement, get_ffff_layout, \
     FFFF_ELT_LENGTH, FFFF_HDR_OFF_FLASH_IMAGE_NAME, \
     FFFF_HDR_OFF_FLASH_CAPACITY, FFFF_FLASH_IMAGE_NAME_LENGTH, \
     FFFF_ELEMENT_END_OF_ELEMENT_TABLE, FFFF_HEADER_COLLISION, \
-    FFFF_HDR_ERASED, FFFF_RSVD_SIZE, FFFF_SENTINEL, \
+    FFFF_HDR_ERASED, FFFF_RSVD_SIZE, FFFF_SENTINEL, FFFF_HDR_FIXED_STRUCT, \
     FFFF_HDR_INVALID, FFFF_HDR_OFF_SENTINEL, \
     FFFF_HDR_OFF_TIMESTAMP, FFFF_HDR_OFF_ERASE_BLOCK_SIZE, \
     FFFF_HDR_OFF_HEADER_SIZE, FFFF_HDR_OFF_FLASH_IMAGE_LENGTH, \
-    FFFF_HDR_OFF_HEADER_GENERATION_NUM, FFFF_HDR_OFF_RESERVED, \
+    FFFF_HDR_OFF_HEADER_GENERATION_NUM, \
     FFFF_ELT_OFF_TYPE, FFFF_ELT_OFF_CLASS, FFFF_ELT_OFF_ID, \
     FFFF_ELT_OFF_GENERATION, FFFF_ELT_OFF_LOCATION, \
-    FFFF_ELT_OFF_LENGTH, FFFF_HDR_NUM_RESERVED, FFFF_HDR_LEN_FIXED_PART, \
+    FFFF_ELT_OFF_LENGTH, \
     FFFF_HEADER_SIZE_MIN, FFFF_HEADER_SIZE_MAX, FFFF_HEADER_SIZE_DEFAULT, \
-    FFFF_HDR_LEN_MIN_RESERVED
+    FFFF_MAX_HEADER_BLOCK_OFFSET, FFFF_HDR_LENGTH, FFFF_SENTINEL_LENGTH, \
+    FFFF_SENTINEL_STRUCT, ffff_validity_names
 import sys
+from ffff_planner import plan_element_layout, get_layout_slack
 from util import error, is_power_of_2, next_boundary, is_constant_fill, \
-    PROGRAM_ERRORS
+    find_collisions, get_timestamp, header_string, PROGRAM_ERRORS
 
 
 def get_header_block_size(erase_block_size, header_size):
@@ -73,6 +73,83 @@ def get_header_block_size(erase_block_size, header_size):
     return size
 
 
+def get_ffff_header_offsets(max_offset=FFFF_MAX_HEADER_BLOCK_OFFSET):
+    """Return the offsets at which the boot ROM looks for FFFF headers
+
+    These are 0 and each power of 2 from the minimum header length up to
+    (but not including) max_offset.
+    """
+    offsets = [0]
+    offset = FFFF_HDR_LENGTH
+    while offset < max_offset:
+        offsets.append(offset)
+        offset <<= 1
+    return offsets
+
+
+def locate_ffff_headers(buf, max_offset=FFFF_MAX_HEADER_BLOCK_OFFSET,
+                        alignment=None):
+    """Find the candidate FFFF headers in a buffer (e.g., a flash dump)
+
+    buf (e.g., a bytearray or mmap) is scanned for FFFF sentinels with a
+    bulk find, keeping those at the offsets where the boot ROM looks for a
+    header (see: get_ffff_header_offsets) or, if alignment is given, at any
+    multiple of alignment below max_offset (e.g., 1, to find a header
+    which has been displaced). A candidate must also have a plausible
+    header_size and, where that puts it, a tail sentinel.
+
+    Returns a list of dictionaries, one per candidate header, ranked the
+    way the boot ROM chooses between headers: the highest generation first
+    and, within a generation, the lowest offset first.
+    """
+    if alignment:
+        allowed = None
+    else:
+        allowed = set(get_ffff_header_offsets(max_offset))
+    if isinstance(buf, memoryview):
+        # (memoryview has no find)
+        buf = buf[:max_offset + FFFF_SENTINEL_LENGTH].tobytes()
+    buf_size = len(buf)
+    scan_end = min(buf_size, max_offset - 1 + FFFF_SENTINEL_LENGTH)
+
+    candidates = []
+    offset = buf.find(FFFF_SENTINEL, 0, scan_end)
+    while offset != -1:
+        if (alignment and offset % alignment == 0) or \
+           (not alignment and offset in allowed):
+            candidate = get_ffff_header_candidate(buf, buf_size, offset)
+            if candidate:
+                candidates.append(candidate)
+        offset = buf.find(FFFF_SENTINEL, offset + 1, scan_end)
+    candidates.sort(key=lambda c: (-c["generation"], c["offset"]))
+    return candidates
+
+
+def get_ffff_header_candidate(buf, buf_size, offset):
+    # Return a dictionary describing the FFFF header whose nose sentinel is
+    # at offset, or None if it has an implausible size or no tail sentinel
+    if offset + FFFF_HDR_FIXED_STRUCT.size > buf_size:
+        return None
+    ffff_hdr = FFFF_HDR_FIXED_STRUCT.unpack_from(buf, offset)
+    header_size = ffff_hdr[5]
+    if (header_size < FFFF_HEADER_SIZE_MIN) or \
+       (header_size > FFFF_HEADER_SIZE_MAX):
+        return None
+    tail_offset = offset + get_ffff_layout(header_size).off_tail_sentinel
+    if tail_offset + FFFF_SENTINEL_LENGTH > buf_size or \
+       FFFF_SENTINEL_STRUCT.unpack_from(buf, tail_offset)[0] != \
+            FFFF_SENTINEL:
+        return None
+    return {"offset": offset,
+            "timestamp": header_string(ffff_hdr[1]),
+            "flash_image_name": header_string(ffff_hdr[2]),
+            "flash_capacity": ffff_hdr[3],
+            "erase_block_size": ffff_hdr[4],
+            "header_size": header_size,
+            "flash_image_length": ffff_hdr[6],
+            "generation": ffff_hdr[7]}
+
+
 # FFFF representation
 #
 class Ffff:
@@ -99,7 +176,7 @@ class Ffff:
         self.erase_block_size = erase_block_size
         self.flash_image_length = image_length
         self.header_generation_number = header_generation_number
-        self.reserved = [0] * FFFF_HDR_NUM_RESERVED
+        self.reserved = []
         self.elements = []
         self.tail_sentinel = ""
 
@@ -121,6 +198,7 @@ class Ffff:
         self.header_validity = FFFF_HDR_VALID
         self.element_location_min = 2 * self.get_header_block_size()
         self.element_location_max = image_length
+        self.pending_copies = []    # Elements to copy in by post_process
 
         # Salt the element table with the end-of-table, because we will be
         # adding sections manually later
@@ -132,46 +210,27 @@ class Ffff:
 
         Because we have variable-size FFFF headers, we need to recalculate the
         number of entries in the section table, and the offsets to all fields
-        which follow.
-        """
-        """ Recalculate element table size and offsets from header_size
-
-        Because we have variable-size FFFF headers, we need to recalculate the
-        number of entries in the section table, and the offsets to all fields
-        which follow.
+        which follow. These are held in this header's layout (see: FfffLayout)
+        rather than in module globals, so FFFF headers with different sizes
+        can coexist.
         """
-        global FFFF_HDR_NUM_ELEMENTS, FFFF_HDR_LEN_ELEMENT_TBL, \
-            FFFF_HDR_NUM_RESERVED, FFFF_HDR_LEN_RESERVED, \
-            FFFF_HDR_OFF_RESERVED, FFFF_HDR_OFF_TAIL_SENTINEL, \
-            FFFF_HDR_LEN_MIN_RESERVED
-        # TFTF section table and derived lengths
-        FFFF_HDR_NUM_ELEMENTS = \
-            ((self.header_size -
-             (FFFF_HDR_LEN_FIXED_PART + FFFF_HDR_LEN_MIN_RESERVED)) //
-             FFFF_ELT_LENGTH)
-        FFFF_HDR_LEN_ELEMENT_TBL = (FFFF_HDR_NUM_ELEMENTS * FFFF_ELT_LENGTH)
-
-        FFFF_HDR_LEN_RESERVED = (self.header_size -
-                                (FFFF_HDR_LEN_FIXED_PART +
-                                 FFFF_HDR_LEN_ELEMENT_TBL))
-        FFFF_HDR_NUM_RESERVED = FFFF_HDR_LEN_RESERVED / FFFF_RSVD_SIZE
-        self.reserved = [0] * FFFF_HDR_NUM_RESERVED
-
-        # Offsets to fields following the section table
-        FFFF_HDR_OFF_ELEMENT_TBL = (FFFF_HDR_OFF_RESERVED +
-                                    FFFF_HDR_LEN_RESERVED)
-        FFFF_HDR_OFF_TAIL_SENTINEL = (FFFF_HDR_OFF_ELEMENT_TBL +
-                                      FFFF_HDR_LEN_ELEMENT_TBL)
+        self.layout = get_ffff_layout(self.header_size)
+        num_reserved = self.layout.num_reserved
+        self.reserved = (self.reserved + [0] * num_reserved)[:num_reserved]
 
     def get_header_block_size(self):
         return get_header_block_size(self.erase_block_size, self.header_size)
 
-    def unpack(self):
-        """Unpack an FFFF header from a buffer"""
+    def unpack(self, load_data=True, lazy=False):
+        """Unpack an FFFF header from a buffer
 
-        fmt_string = "<16s16s48sLLLLL" + "L" * FFFF_HDR_NUM_RESERVED
-        ffff_hdr = unpack_from(fmt_string, self.ffff_buf,
-                               self.header_offset)
+        If load_data is False, the elements' TFTFs are not parsed, and if
+        lazy is True, they are only parsed as they're needed (see:
+        FfffElement.unpack).
+        """
+
+        ffff_hdr = FFFF_HDR_FIXED_STRUCT.unpack_from(self.ffff_buf,
+                                                     self.header_offset)
         self.sentinel = ffff_hdr[0]
         self.timestamp = ffff_hdr[1]
         self.flash_image_name = ffff_hdr[2]
@@ -180,17 +239,23 @@ class Ffff:
         self.header_size = ffff_hdr[5]
         self.flash_image_length = ffff_hdr[6]
         self.header_generation_number = ffff_hdr[7]
-        for i in range(FFFF_HDR_NUM_RESERVED):
-            self.reserved[i] = ffff_hdr[8+i]
 
-        # Now that we have parsed the header_size, recalculate the size of the
-        # element table and the offsets to all FFFF header fields which follow
-        # it.
-        self.recalculate_header_offsets()
+        # Now that we have parsed the header_size, switch to the layout for
+        # that size to find the element table and the FFFF header fields
+        # which follow it. (A nonsensical size, e.g. from an erased block, is
+        # parsed with the default layout and rejected by validation.)
+        if (self.header_size < FFFF_HEADER_SIZE_MIN) or \
+           (self.header_size > FFFF_HEADER_SIZE_MAX):
+            self.layout = get_ffff_layout(FFFF_HEADER_SIZE_DEFAULT)
+        else:
+            self.recalculate_header_offsets()
+        layout = self.layout
+        self.reserved = list(layout.reserved_struct.unpack_from(
+            self.ffff_buf, self.header_offset + layout.off_reserved))
 
         # Unpack the tail sentinel
-        ffff_hdr = unpack_from("<16s", self.ffff_buf,
-                               self.header_offset + FFFF_HDR_OFF_TAIL_SENTINEL)
+        ffff_hdr = layout.sentinel_struct.unpack_from(
+            self.ffff_buf, self.header_offset + layout.off_tail_sentinel)
         self.tail_sentinel = ffff_hdr[0]
 
         # Determine the ROM range that can hold the elements
@@ -199,18 +264,17 @@ class Ffff:
 
         # Parse the table of element headers
         self.elements = []
-        offset = FFFF_HDR_OFF_ELEMENT_TBL
-        for index in range(FFFF_HDR_NUM_ELEMENTS):
+        offset = self.header_offset + layout.off_element_tbl
+        for index in range(layout.num_elements):
             element = FfffElement(index,
                                   self.ffff_buf,
                                   self.flash_capacity,
                                   self.erase_block_size,
                                   0, 0, 0, 0, 0, 0)
-            eot = element.unpack(self.ffff_buf, offset)
+            eot = element.unpack(self.ffff_buf, offset, load_data, lazy)
             self.elements.append(element)
             offset += FFFF_ELT_LENGTH
             if eot:
-                print("unpack done")
                 break
         self.validate_ffff_header()
 
@@ -224,7 +288,7 @@ class Ffff:
         # Populate the fixed part of the FFFF header.
         # (Note that we need to break up the packing because the "s" format
         # won't zero-pad a string shorter than the field width)
-        timestamp = strftime("%Y%m%d %H%M%S", gmtime())
+        timestamp = get_timestamp()
         pack_into("<16s16s", self.ffff_buf, self.header_offset,
                   self.sentinel, timestamp)
         if self.flash_image_name:
@@ -238,36 +302,45 @@ class Ffff:
                   self.header_size,
                   self.flash_image_length,
                   self.header_generation_number)
-        for i in range(FFFF_HDR_NUM_RESERVED):
-            pack_into("<L", self.ffff_buf,
-                      self.header_offset + FFFF_HDR_OFF_RESERVED +
-                      (FFFF_RSVD_SIZE * i),
-                      self.reserved[i])
+        layout = self.layout
+        layout.reserved_struct.pack_into(self.ffff_buf,
+                                         self.header_offset +
+                                         layout.off_reserved,
+                                         *self.reserved)
 
         # Pack the element headers into the FFFF header buffer
-        offset = self.header_offset + FFFF_HDR_OFF_ELEMENT_TBL
+        offset = self.header_offset + layout.off_element_tbl
         for element in self.elements:
             offset = element.pack(self.ffff_buf, offset)
 
         # Finally, add the tail sentinel
-        pack_into("<16s", self.ffff_buf,
-                  self.header_offset + FFFF_HDR_OFF_TAIL_SENTINEL,
-                  self.tail_sentinel)
+        layout.sentinel_struct.pack_into(self.ffff_buf,
+                                         self.header_offset +
+                                         layout.off_tail_sentinel,
+                                         self.tail_sentinel)
 
     def add_element(self, element_type, element_class, element_id,
                     element_length, element_location, element_generation,
-                    filename):
+                    filename, copy_data=True, alignment=0):
         """Add a new element to the element table
 
         Adds an element to the element table but doesn't load the TFTF
         file into the ROMimage buffer.  That is done later by post_process.
         Returns a success flag
 
+        If copy_data is False, the TFTF is not copied into the ROMimage
+        buffer (e.g., because the other FFFF header in the same buffer
+        puts it there).
+
+        An element_location of 0 leaves the element to be placed by
+        post_process, at a multiple of alignment (if given) or of the erase
+        block size.
+
         (We would typically be called by "create-ffff" after parsing element
         parameters.)
         """
         num_elements = len(self.elements)
-        if num_elements < FFFF_HDR_NUM_ELEMENTS:
+        if num_elements < self.layout.num_elements:
             element = FfffElement(len(self.elements),
                                   self.ffff_buf,
                                   self.flash_capacity,
@@ -285,14 +358,15 @@ class Ffff:
                     self.elements.append(element)
                 return True
 
+            element.alignment = alignment
             if element.init():
                 # Because the table always ends in a EOT entry, we "append"
                 # new elements by inserting them just before the EOT element.
                 self.elements.insert(num_elements - 1, element)
 
-                span_start = element.element_location
-                span_end = span_start + len(element.tftf_blob.tftf_buf)
-                self.ffff_buf[span_start:span_end] = element.tftf_blob.tftf_buf
+                # (The TFTF is copied in once the element has a location)
+                if copy_data:
+                    self.pending_copies.append(element)
                 return True
             else:
                 return False
@@ -313,12 +387,28 @@ class Ffff:
         self.duplicates_found = False
         self.invalid_elements_found = False
 
-        for i, elt_a in enumerate(self.elements):
-            collision = []
-            duplicate = []
-
-            if elt_a.element_type == FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
+        elements = []
+        for elt in self.elements:
+            if elt.element_type == FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
                 break
+            elements.append(elt)
+
+        # Check for inter-element collisions
+        extents = [(elt.element_location,
+                    elt.element_location + elt.element_length - 1)
+                   for elt in elements]
+        element_collisions = find_collisions(extents)
+
+        # Check for duplicate entries. Per the specification: "At most, one
+        # element table entry with a particular element type, element ID,
+        # and element generation may be present in the element table."
+        keys = {}
+        for i, elt in enumerate(elements):
+            keys.setdefault((elt.element_type, elt.element_id,
+                             elt.element_generation), []).append(i)
+
+        for i, elt_a in enumerate(elements):
+            collision = []
 
             # Check for an invalid element (i.e., either munged or
             # collides with the 2 FFFF header blocks)
@@ -333,38 +423,24 @@ class Ffff:
                       " collides with two header blocks of size " +
                       format(2 * self.get_header_block_size(), "#x"))
 
-            for j, elt_b in enumerate(self.elements):
-                # skip checking one's self
-                if i != j:
-                    # extract elements[j]
-                    if elt_b.element_type == \
-                            FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
-                        break
-
-                    # check for collision
-                    elt_a.validate_against(elt_b)
-                    start_a = elt_a.element_location
-                    end_a = start_a + elt_a.element_length - 1
-                    start_b = elt_b.element_location
-                    end_b = start_b + elt_b.element_length - 1
-                    if end_b >= start_a and start_b <= end_a:
-                        self.collisions_found = True
-                        collision += [j]
-                        error("Element [{0:d}] @ {1:x}-{2:x} collides with "\
-                              "element [{3:d}] @ {4:x}-{5:x}".
-                              format(i, start_a, end_a, j, start_b, end_b)) 
-
-                    # check for other duplicate entries
-                    # Per the specification: "At most, one element table
-                    # entry with a particular element type, element ID,
-                    # and element generation may be present in the element
-                    # table."
-                    if elt_a.element_type == elt_b.element_type and \
-                       elt_a.element_id == elt_b.element_id and \
-                       elt_a.element_generation == elt_b.element_generation:
-                        self.duplicates_found = True
-                        duplicate += [j]
-
+            start_a, end_a = extents[i]
+            for j in element_collisions[i]:
+                start_b, end_b = extents[j]
+                self.collisions_found = True
+                collision += [j]
+                error("Element [{0:d}] @ {1:x}-{2:x} collides with "
+                      "element [{3:d}] @ {4:x}-{5:x}".
+                      format(i, start_a, end_a, j, start_b, end_b))
+
+            duplicate = [j for j in keys[(elt_a.element_type,
+                                          elt_a.element_id,
+                                          elt_a.element_generation)]
+                         if j != i]
+            if duplicate:
+                self.duplicates_found = True
+
+            elt_a.collisions = collision
+            elt_a.duplicates = duplicate
             self.collisions += [collision]
             self.duplicates += [duplicate]
         if self.collisions_found:
@@ -422,9 +498,9 @@ class Ffff:
                 return self.header_validity
 
         # Verify that the unused portions of the header are zeroed, per spec.
-        span_start = self.header_offset + FFFF_HDR_OFF_ELEMENT_TBL + \
+        span_start = self.header_offset + self.layout.off_element_tbl + \
             len(self.elements) * FFFF_ELT_LENGTH
-        span_end = self.header_offset + FFFF_HDR_OFF_TAIL_SENTINEL - \
+        span_end = self.header_offset + self.layout.off_tail_sentinel - \
             span_start
         if not is_constant_fill(self.ffff_buf[span_start:span_end], 0):
             error("Unused portions of FFFF header are non-zero: "
@@ -442,50 +518,68 @@ class Ffff:
     def post_process(self, buf):
         """Post-process the FFFF header
 
-        Process the FFFF header, assigning unspecified element locations to
-        be contiguous (on erase-block-size boundaries), and read the TFTF
-        files into the buffer at those locations.
+        Process the FFFF header, placing the elements which have no location
+        (see: ffff_planner), and copy the TFTF files into the buffer at
+        their locations (see: get_placement).
 
         (Called by "create-ffff" after processing all arguments)
         """
         # Revalidate the erase block size
         self.erase_block_mask = self.erase_block_size - 1
 
-        # Scan the elements and fill in missing start locations.
-        # Elements are concatenated at the granuarity of the erase block size
-        location = self.elements[0].element_location
+        elements = []
         for index, element in enumerate(self.elements):
             element.index = index
-            if element.element_type != FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
-                if element.element_location == 0:
-                    element.element_location = location
-                    error("Note: Assuming element [{0:d}]"
-                          " loads at {1:08x}".format(element.index, location))
-                if self.flash_image_length != 0 and \
-                   element.element_location + element.element_length >= \
-                   self.flash_image_length:
-                    error("--element-location " +
-                          format(element.element_location, "#x") +
-                          " + --element-length " +
-                          format(element.element_length, "#x") +
-                          " exceeds --image-length " +
-                          format(self.flash_image_length, "#x"))
-                    sys.exit(PROGRAM_ERRORS)
-                location = next_boundary(element.element_location +
-                                         element.element_length,
-                                         self.erase_block_size)
             if element.element_type == FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
                 break
+            elements.append(element)
+
+        # Check that the pinned elements fit in the image, then place the
+        # rest around them
+        for element in elements:
+            if element.element_location != 0:
+                self.check_element_fits(element)
+        try:
+            locations = plan_element_layout(
+                [(element.element_location, element.element_length,
+                  element.alignment) for element in elements],
+                self.erase_block_size, self.element_location_min,
+                self.flash_image_length)
+        except ValueError as e:
+            error(e)
+            sys.exit(PROGRAM_ERRORS)
+        for element, location in zip(elements, locations):
+            if element.element_location == 0:
+                element.element_location = location
+                error("Note: Assuming element [{0:d}]"
+                      " loads at {1:08x}".format(element.index, location))
+                self.check_element_fits(element)
+
+        # Copy the TFTFs into the buffer
+        for element in self.pending_copies:
+            if element.tftf_blob:
+                span_start = element.element_location
+                span_end = span_start + len(element.tftf_blob.tftf_buf)
+                self.ffff_buf[span_start:span_end] = \
+                    element.tftf_blob.tftf_buf
+        self.pending_copies = []
 
         if self.flash_image_length == 0:
-            self.flash_image_length = location
+            # Size the image to end with the last element
+            self.flash_image_length = self.element_location_min
+            for element in elements:
+                self.flash_image_length = max(
+                    self.flash_image_length,
+                    next_boundary(element.element_location +
+                                  element.element_length,
+                                  self.erase_block_size))
 
         self.validate_element_table()
 
         # fill in and/or trim selected FFFF fields
         self.sentinel = FFFF_SENTINEL
 
-        self.timestamp = strftime("%Y%m%d %H%M%S", gmtime())
+        self.timestamp = get_timestamp()
         if self.flash_image_name:
             self.flash_image_name = \
                 self.flash_image_name[0:FFFF_FLASH_IMAGE_NAME_LENGTH]
@@ -496,6 +590,43 @@ class Ffff:
         self.pack()
         self.validate_ffff_header()
 
+    def get_placement(self):
+        """Return the layout of the elements
+
+        Returns a list of dictionaries, one per element in table order,
+        giving its location, length and slack (the unused space after it,
+        see: ffff_planner.get_layout_slack).
+        """
+        elements = []
+        for element in self.elements:
+            if element.element_type == FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
+                break
+            elements.append(element)
+        slack = get_layout_slack([(element.element_location,
+                                   element.element_length)
+                                  for element in elements],
+                                 self.erase_block_size,
+                                 self.flash_image_length)
+        return [{"index": element.index,
+                 "type": element.element_type,
+                 "location": element.element_location,
+                 "length": element.element_length,
+                 "slack": element_slack}
+                for element, element_slack in zip(elements, slack)]
+
+    def check_element_fits(self, element):
+        # Exit if an element overruns the image
+        if self.flash_image_length != 0 and \
+           element.element_location + element.element_length > \
+           self.flash_image_length:
+            error("--element-location " +
+                  format(element.element_location, "#x") +
+                  " + --element-length " +
+                  format(element.element_length, "#x") +
+                  " exceeds --image-length " +
+                  format(self.flash_image_length, "#x"))
+            sys.exit(PROGRAM_ERRORS)
+
     def same_as(self, other):
         """Determine if this FFFF is identical to another"""
         # Compare the element tables
@@ -529,6 +660,32 @@ class Ffff:
             if element.element_type == FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
                 break
 
+    def to_dict(self):
+        """Return the FFFF header fields as a dictionary
+
+        This is the machine-readable counterpart of display(), for JSON
+        output.
+        """
+        elements = []
+        for element in self.elements:
+            if element.element_type == FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
+                break
+            elements.append(element.to_dict())
+        return {"header_offset": self.header_offset,
+                "sentinel": header_string(self.sentinel),
+                "timestamp": header_string(self.timestamp),
+                "flash_image_name": header_string(self.flash_image_name),
+                "flash_capacity": self.flash_capacity,
+                "erase_block_size": self.erase_block_size,
+                "header_size": self.header_size,
+                "flash_image_length": self.flash_image_length,
+                "header_generation": self.header_generation_number,
+                "reserved": list(self.reserved),
+                "tail_sentinel": header_string(self.tail_sentinel),
+                "validity": ffff_validity_names.get(self.header_validity,
+                                                    "invalid"),
+                "elements": elements}
+
     def display_element_table(self):
         # Display the FFFF header's element table in human-readable form
 
@@ -540,12 +697,12 @@ class Ffff:
                 break
 
         # Note any unused elements
-        num_unused_elements = FFFF_HDR_NUM_ELEMENTS - len(self.elements)
+        num_unused_elements = self.layout.num_elements - len(self.elements)
         if num_unused_elements > 1:
             print("  {0:2d} (unused)".format(len(self.elements)))
             print("   :    :")
         if num_unused_elements > 0:
-            print("  {0:2d} (unused)".format(FFFF_HDR_NUM_ELEMENTS-1))
+            print("  {0:2d} (unused)".format(self.layout.num_elements - 1))
 
     def display_element_data(self, header_index):
         # Display the element data (TFTFs) from the element table
@@ -634,14 +791,14 @@ class Ffff:
         for i in range(len(self.reserved)):
             wf.write("{0:s}reserved[{1:d}]  {2:08x}\n".
                      format(prefix, i,
-                            base_offset + FFFF_HDR_OFF_RESERVED +
+                            base_offset + self.layout.off_reserved +
                             (FFFF_RSVD_SIZE * i)))
 
         # Add the element table
         wf.write("{0:s}element_table  {1:08x}\n".
-                 format(prefix, base_offset + FFFF_HDR_OFF_ELEMENT_TBL))
-        element_offset = base_offset + FFFF_HDR_OFF_ELEMENT_TBL
-        for index in range(FFFF_HDR_NUM_ELEMENTS):
+                 format(prefix, base_offset + self.layout.off_element_tbl))
+        element_offset = base_offset + self.layout.off_element_tbl
+        for index in range(self.layout.num_elements):
             wf.write("{0:s}element[{1:d}].type  {2:08x}\n".
                      format(prefix, index,
                             element_offset + FFFF_ELT_OFF_TYPE))
@@ -664,7 +821,7 @@ class Ffff:
 
         # Add the tail sentinel
         wf.write("{0:s}tail_sentinel  {1:08x}\n".
-                 format(prefix, base_offset + FFFF_HDR_OFF_TAIL_SENTINEL))
+                 format(prefix, base_offset + self.layout.off_tail_sentinel))
 
     def write_map_elements(self, wf, base_offset, prefix=""):
         """Display the field names and offsets of a single FFFF header"""
@@ -0,0 +1,269 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+## Erase-block delta plans between FFFF images
+#
+# A delta plan lists the erase blocks which must be erased and/or
+# programmed to turn a flash holding an old FFFF image into one holding a
+# new image. It's found by comparing the images' per-erase-block digests
+# (see: FfffRomimage.get_block_digests), so the old image can be just its
+# digest manifest (e.g., recorded when a test rig was last flashed).
+# Unchanged blocks are left alone, blocks which are erased in the old
+# image aren't erased again, and blocks which are erased in the new image
+# aren't programmed. Runs of blocks needing the same operations are merged
+# into ranges.
+#
+# Plans are written as JSON (with hex payloads) or in a simple binary
+# format, for a flasher (or apply-ffff-delta, as a stand-in) to apply:
+#
+#   header: magic ("FFFFDLTA"), version, erase block size, image length,
+#           number of ranges, SHA-256 digest of the new image
+#   ranges: offset, length, flags (DELTA_ERASE | DELTA_PROGRAM), followed
+#           by the new contents of the range if it's to be programmed
+#
+# with the integers 32-bit little-endian, like the FFFF headers.
+
+from __future__ import print_function
+import binascii
+import hashlib
+import io
+import json
+from struct import Struct, error as struct_error
+
+DELTA_MAGIC = b"FFFFDLTA"
+DELTA_VERSION = 1
+DELTA_HASH_ALGORITHM = "sha256"
+DELTA_HEADER_STRUCT = Struct("<8sLLLL32s")
+DELTA_RANGE_STRUCT = Struct("<LLL")
+
+# Range flags
+DELTA_ERASE = 0x01
+DELTA_PROGRAM = 0x02
+
+# The contents of erased flash
+ERASED_BYTE = b"\xff"
+
+# Size of the blob to digest or write each time
+delta_blob_size = 1024 * 1024
+
+
+def get_erased_digest(length, hash_algorithm):
+    # Return the (hex) digest of an erased block
+    return hashlib.new(hash_algorithm, ERASED_BYTE * length).hexdigest()
+
+
+def plan_delta(old_manifest, new_romimage):
+    """Return the erase/program plan from an old FFFF image to a new one
+
+    old_manifest is the per-erase-block digest manifest of the old image
+    (see: FfffRomimage.get_block_digests), and new_romimage the new image.
+    Blocks beyond the end of the old image are assumed to hold anything.
+
+    Returns a plan: a dictionary of the image's erase block size, length
+    and digest, and a list of ranges (offset, length, erase and program
+    flags, and for those to be programmed, their payload). Raises
+    ValueError if the images have different erase block sizes.
+    """
+    block_size = new_romimage.erase_block_size
+    if old_manifest["erase_block_size"] != block_size:
+        raise ValueError("The images have different erase block sizes "
+                         "(0x{0:x} and 0x{1:x})".format(
+                             old_manifest["erase_block_size"], block_size))
+    hash_algorithm = old_manifest["hash_algorithm"]
+    old_blocks = old_manifest["blocks"]
+    new_manifest = new_romimage.get_block_digests(hash_algorithm)
+    image_length = new_manifest["image_length"]
+    buf = new_romimage.ffff_buf
+
+    ranges = []
+    erased_digests = {}
+    for block, new_digest in enumerate(new_manifest["blocks"]):
+        offset = block * block_size
+        length = min(block_size, image_length - offset)
+        old_digest = old_blocks[block] if block < len(old_blocks) else None
+        if old_digest == new_digest:
+            continue
+        if length not in erased_digests:
+            erased_digests[length] = get_erased_digest(length,
+                                                       hash_algorithm)
+        erase = old_digest != erased_digests[length]
+        program = new_digest != erased_digests[length]
+        if ranges and ranges[-1]["offset"] + ranges[-1]["length"] == \
+                offset and ranges[-1]["erase"] == erase and \
+                ranges[-1]["program"] == program:
+            ranges[-1]["length"] += length
+        else:
+            ranges.append({"offset": offset,
+                           "length": length,
+                           "erase": erase,
+                           "program": program})
+    for extent in ranges:
+        if extent["program"]:
+            extent["payload"] = bytes(buf[extent["offset"]:
+                                          extent["offset"] +
+                                          extent["length"]])
+
+    return {"erase_block_size": block_size,
+            "image_length": image_length,
+            "hash_algorithm": DELTA_HASH_ALGORITHM,
+            "digest": get_buffer_digest(buf, image_length,
+                                        DELTA_HASH_ALGORITHM),
+            "ranges": ranges}
+
+
+def get_buffer_digest(buf, length, hash_algorithm):
+    # Return the (hex) digest of the start of a buffer (or mmap)
+    digest = hashlib.new(hash_algorithm)
+    for offset in range(0, length, delta_blob_size):
+        digest.update(buf[offset:min(offset + delta_blob_size, length)])
+    return digest.hexdigest()
+
+
+def get_file_digest(filename, length, hash_algorithm):
+    # Return the (hex) digest of the start of a file, or None if it's short
+    digest = hashlib.new(hash_algorithm)
+    with io.open(filename, 'rb') as rf:
+        while length > 0:
+            blob = rf.read(min(length, delta_blob_size))
+            if not blob:
+                return None
+            digest.update(blob)
+            length -= len(blob)
+    return digest.hexdigest()
+
+
+def write_delta(plan, filename, as_json=False):
+    """Write a delta plan, in binary or (if as_json) JSON format"""
+    if as_json:
+        ranges = []
+        for extent in plan["ranges"]:
+            extent = dict(extent)
+            if "payload" in extent:
+                extent["payload"] = binascii.hexlify(
+                    extent["payload"]).decode("ascii")
+            ranges.append(extent)
+        with open(filename, 'w') as wf:
+            json.dump(dict(plan, ranges=ranges), wf, sort_keys=True,
+                      indent=2, separators=(",", ": "))
+            wf.write("\n")
+        return
+
+    with open(filename, 'wb') as wf:
+        wf.write(DELTA_HEADER_STRUCT.pack(
+            DELTA_MAGIC, DELTA_VERSION, plan["erase_block_size"],
+            plan["image_length"], len(plan["ranges"]),
+            binascii.unhexlify(plan["digest"])))
+        for extent in plan["ranges"]:
+            flags = (DELTA_ERASE if extent["erase"] else 0) | \
+                (DELTA_PROGRAM if extent["program"] else 0)
+            wf.write(DELTA_RANGE_STRUCT.pack(extent["offset"],
+                                             extent["length"], flags))
+            if extent["program"]:
+                wf.write(extent["payload"])
+
+
+def read_delta(filename):
+    """Read a delta plan written by write_delta (in either format)
+
+    Raises IOError if it can't be read, and ValueError if it's malformed.
+    """
+    with open(filename, 'rb') as rf:
+        data = rf.read()
+    if not data.startswith(DELTA_MAGIC):
+        try:
+            plan = json.loads(data.decode("utf-8"))
+            for extent in plan["ranges"]:
+                if extent["program"]:
+                    extent["payload"] = binascii.unhexlify(
+                        extent["payload"])
+            return plan
+        except (ValueError, KeyError, TypeError):
+            raise ValueError("{0:s} is not a delta plan".format(filename))
+
+    try:
+        magic, version, block_size, image_length, num_ranges, digest = \
+            DELTA_HEADER_STRUCT.unpack_from(data, 0)
+        if version != DELTA_VERSION:
+            raise ValueError("{0:s} is a version {1:d} delta plan".format(
+                             filename, version))
+        offset = DELTA_HEADER_STRUCT.size
+        ranges = []
+        for _ in range(num_ranges):
+            range_offset, length, flags = \
+                DELTA_RANGE_STRUCT.unpack_from(data, offset)
+            offset += DELTA_RANGE_STRUCT.size
+            extent = {"offset": range_offset,
+                      "length": length,
+                      "erase": bool(flags & DELTA_ERASE),
+                      "program": bool(flags & DELTA_PROGRAM)}
+            if extent["program"]:
+                extent["payload"] = data[offset:offset + length]
+                if len(extent["payload"]) != length:
+                    raise ValueError("{0:s} is truncated".format(filename))
+                offset += length
+            ranges.append(extent)
+    except struct_error:
+        raise ValueError("{0:s} is truncated".format(filename))
+    return {"erase_block_size": block_size,
+            "image_length": image_length,
+            "hash_algorithm": DELTA_HASH_ALGORITHM,
+            "digest": binascii.hexlify(digest).decode("ascii"),
+            "ranges": ranges}
+
+
+def apply_delta(plan, flash_filename):
+    """Apply a delta plan to a flash image file
+
+    This is a stand-in for a flasher: each range of the file is erased
+    (filled with 0xff) and/or programmed, as the plan says. A file shorter
+    than the image is first extended with erased blocks.
+    """
+    with io.open(flash_filename, 'r+b') as wf:
+        wf.seek(0, 2)
+        length = wf.tell()
+        while length < plan["image_length"]:
+            blob_length = min(plan["image_length"] - length,
+                              delta_blob_size)
+            wf.write(ERASED_BYTE * blob_length)
+            length += blob_length
+        for extent in plan["ranges"]:
+            # (Erasing and then programming a range leaves just the
+            # payload, so that's all the stand-in need write)
+            wf.seek(extent["offset"])
+            if extent["program"]:
+                wf.write(extent["payload"])
+            elif extent["erase"]:
+                wf.write(ERASED_BYTE * extent["length"])
+
+
+def verify_delta(plan, flash_filename):
+    """Check that a flash image file holds a delta plan's new image"""
+    return get_file_digest(flash_filename, plan["image_length"],
+                           plan["hash_algorithm"]) == plan["digest"]
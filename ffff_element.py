@@ -29,9 +29,10 @@
 #
 
 from __future__ import print_function
-from struct import unpack_from, pack_into
-from tftf import Tftf
-from util import error, block_aligned
+import threading
+from struct import Struct
+from tftf import Tftf, load_tftf
+from util import error, block_aligned, buffer_slice
 
 
 # TFTF Sentinel value.
@@ -149,12 +150,92 @@ FFFF_HDR_OFF_ELEMENT_TBL = (FFFF_HDR_OFF_RESERVED +
 FFFF_HDR_OFF_TAIL_SENTINEL = (FFFF_HDR_OFF_ELEMENT_TBL +
                               FFFF_HDR_LEN_ELEMENT_TBL)
 
+# Precompiled FFFF formats
+FFFF_ELT_STRUCT = Struct("<LLLLL")
+FFFF_SENTINEL_STRUCT = Struct("<16s")
+FFFF_HDR_FIXED_STRUCT = Struct("<16s16s48sLLLLL")
+
 FFFF_FILE_EXTENSION = ".ffff"
 
 # TFTF validity assesments
 FFFF_HDR_VALID = 0
 FFFF_HDR_ERASED = 1
 FFFF_HDR_INVALID = 2
+ffff_validity_names = {
+    FFFF_HDR_VALID: "valid",
+    FFFF_HDR_ERASED: "erased",
+    FFFF_HDR_INVALID: "invalid",
+}
+
+# Cache of FFFF header layouts, indexed by header size (see: get_ffff_layout)
+ffff_layouts = {}
+ffff_layouts_lock = threading.Lock()
+
+
+class FfffLayout(object):
+    """Field layout of an FFFF header of a given size
+
+    Because we have variable-size FFFF headers, the number of entries in the
+    element table, and the offsets to all fields which follow, depend on the
+    header size. An FfffLayout captures these for one header size, along
+    with the precompiled header formats.
+
+    The element table immediately follows the (minimum) reserved words, and
+    the tail sentinel occupies the last 16 bytes of the header. Any bytes
+    left over between the two are unused (and must be zero).
+
+    Layouts are immutable, so they can be shared between FFFF headers (and
+    threads). Use get_ffff_layout() rather than creating them directly.
+    """
+    def __init__(self, header_size):
+        """Constructor"""
+        # FFFF element table and derived lengths
+        num_elements = \
+            ((header_size -
+             (FFFF_HDR_LEN_FIXED_PART + FFFF_HDR_LEN_MIN_RESERVED)) //
+             FFFF_ELT_LENGTH)
+        len_element_tbl = num_elements * FFFF_ELT_LENGTH
+        num_reserved = FFFF_HDR_NUM_RESERVED_MIN
+        len_reserved = FFFF_HDR_LEN_MIN_RESERVED
+        off_element_tbl = FFFF_HDR_OFF_RESERVED + len_reserved
+
+        fields = {
+            "header_size": header_size,
+            "num_elements": num_elements,
+            "len_element_tbl": len_element_tbl,
+            "num_reserved": num_reserved,
+            "len_reserved": len_reserved,
+            "off_reserved": FFFF_HDR_OFF_RESERVED,
+            "off_element_tbl": off_element_tbl,
+            "off_unused": off_element_tbl + len_element_tbl,
+            "off_tail_sentinel": header_size - FFFF_HDR_LEN_TAIL_SENTINEL,
+            # The fixed part of the header plus the reserved array
+            "header_struct": Struct("<16s16s48sLLLLL" + "L" * num_reserved),
+            "reserved_struct": Struct("<" + "L" * num_reserved),
+            "sentinel_struct": FFFF_SENTINEL_STRUCT,
+            "element_struct": FFFF_ELT_STRUCT,
+        }
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FfffLayout is immutable")
+
+
+def get_ffff_layout(header_size):
+    """Return the (shared) FfffLayout for an FFFF header size
+
+    Each layout is computed only once per header size.
+    """
+    layout = ffff_layouts.get(header_size)
+    if not layout:
+        with ffff_layouts_lock:
+            layout = ffff_layouts.get(header_size)
+            if not layout:
+                layout = FfffLayout(header_size)
+                ffff_layouts[header_size] = layout
+    return layout
+
 
 element_names = {
     FFFF_ELEMENT_END_OF_ELEMENT_TABLE: "end of elements",
@@ -196,12 +277,14 @@ class FfffElement:
         # Private vars
         self.filename = filename
         self.tftf_blob = None
+        self.span = None    # Unparsed TFTF (see: unpack, get_tftf)
         self.buf = buf
         self.buf_size = buf_size
         self.index = index
         self.erase_block_size = erase_block_size
         self.collisions = []
         self.duplicates = []
+        self.alignment = 0  # Placement alignment (see: ffff_planner)
         if element_type == FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
             # EOT is always valid
             self.in_range = True
@@ -227,29 +310,33 @@ class FfffElement:
         that of the file.  Returns a success flag if the file was loaded
         (no file is treated as success).
         """
-        success = True
         # Try to size it from the TFTF file
         if self.filename and not self.tftf_blob:
-            # Create a TFTF blob and load the contents from the specified
-            # TFTF file
-            self.tftf_blob = Tftf(0, self.filename)
-            success = self.tftf_blob.load_tftf_file(self.filename)
-            if success and self.tftf_blob.is_good():
+            # Get the TFTF blob for the specified TFTF file. (This comes
+            # from the TFTF cache, so the file is only read and parsed
+            # once, no matter how many elements or headers refer to it.)
+            self.tftf_blob = load_tftf(self.filename)
+            if self.tftf_blob and self.tftf_blob.is_good():
                 # element_length must be that of the entire TFTF blob,
                 # not just the TFTF's "load_length" or "expanded_length".
                 self.element_length = self.tftf_blob.tftf_length
             else:
-                raise ValueError("Bad TFTF file: {0:x}".format(self.filename))
+                raise ValueError("Bad TFTF file: {0:s}".format(self.filename))
         return True
 
-    def unpack(self, buf, offset):
+    def unpack(self, buf, offset, load_data=True, lazy=False):
         """Unpack an element header from an FFFF header buffer
 
         Unpacks an element header from an FFFF header buffer at the specified
         offset.  Returns a flag indicating if the unpacked element is an
-        end-of-table marker
+        end-of-table marker. If load_data is False, the element's TFTF is
+        not parsed (e.g., when only the FFFF headers are of interest).
+
+        If lazy is True, the element just keeps a zero-copy view of its span
+        of the buffer (e.g., a memory-mapped image), and its TFTF is only
+        parsed when it's asked for (see: get_tftf).
         """
-        element_hdr = unpack_from("<LLLLL", buf, offset)
+        element_hdr = FFFF_ELT_STRUCT.unpack_from(buf, offset)
         type_class = element_hdr[0]
         self.element_type = type_class & 0x000000ff
         self.element_class = (type_class >> 8) & 0x00ffffff
@@ -260,13 +347,18 @@ class FfffElement:
 
         # Get the element data into our tftf_blob
         if self.element_type != FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
+            if not load_data:
+                return False
+
             # Create a TFTF blob and load the contents from the specified
             # TFTF file
+            if lazy:
+                self.span = buffer_slice(buf, self.element_location,
+                                         self.element_length)
+                return False
             span_start = self.element_location
             span_end = span_start + self.element_length
             self.tftf_blob = Tftf(0, None)
-            span_start = self.element_location
-            span_end = span_start + self.element_length
             self.tftf_blob.load_tftf_from_buffer(buf[span_start:span_end])
             return False
         else:
@@ -276,6 +368,17 @@ class FfffElement:
             self.valid_type = True
             return True
 
+    def get_tftf(self):
+        """Return the element's TFTF (or None)
+
+        For a lazily unpacked element, the TFTF is parsed from the element's
+        span of the buffer the first time it's asked for.
+        """
+        if not self.tftf_blob and self.span is not None:
+            self.tftf_blob = Tftf(0, None)
+            self.tftf_blob.load_tftf_from_buffer(self.span)
+        return self.tftf_blob
+
     def pack(self, buf, offset):
         """Pack an element header into an FFFF header
 
@@ -283,12 +386,12 @@ class FfffElement:
         specified offset and returns the offset for the next element
         """
         type_class = (self.element_class << 8) | self.element_type
-        pack_into("<LLLLL", buf, offset,
-                  type_class,
-                  self.element_id,
-                  self.element_length,
-                  self.element_location,
-                  self.element_generation)
+        FFFF_ELT_STRUCT.pack_into(buf, offset,
+                                  type_class,
+                                  self.element_id,
+                                  self.element_length,
+                                  self.element_location,
+                                  self.element_generation)
         return offset + FFFF_ELT_LENGTH
 
     def validate(self, address_range_low, address_range_high):
@@ -324,26 +427,6 @@ class FfffElement:
             self.element_type <= FFFF_ELEMENT_DATA
         return self.in_range and self.aligned and self.valid_type
 
-    def validate_against(self, other):
-        # Validate an element header against another element header
-
-        # Check for collision
-        start_a = self.element_location
-        end_a = start_a + self.element_length - 1
-        start_b = other.element_location
-        end_b = start_b + other.element_length - 1
-        if end_b >= start_a and start_b <= end_a:
-            self.collisions += [other.index]
-
-        # Check for other duplicate entries per the specification:
-        # "At most, one element table entry with a particular element
-        # type, element ID, and element generation may be present in
-        # the element table."
-        if self.element_type == other.element_type and \
-           self.element_id == other.element_id and \
-           self.element_generation == other.element_generation:
-            self.duplicates += [other.index]
-
     def same_as(self, other):
         """Determine if this TFTF is identical to another"""
 
@@ -380,6 +463,27 @@ class FfffElement:
         if element_type in element_short_names:
             return element_short_names[element_type]
 
+    def to_dict(self):
+        """Return the element header fields as a dictionary
+
+        The element's TFTF header is included, if it has been (or can be)
+        loaded.
+        """
+        element_dict = {"index": self.index,
+                        "type": self.element_type,
+                        "type_name": self.element_short_name(
+                            self.element_type),
+                        "class": self.element_class,
+                        "id": self.element_id,
+                        "length": self.element_length,
+                        "location": self.element_location,
+                        "generation": self.element_generation,
+                        "collisions": self.collisions,
+                        "duplicates": self.duplicates}
+        if self.get_tftf():
+            element_dict["tftf"] = self.tftf_blob.to_dict()
+        return element_dict
+
     def display_table_header(self):
         # Print the element table column names
         print("     Type Class  ID       Length   Location Generation")
@@ -406,13 +510,13 @@ class FfffElement:
         # Note any collisions and duplicates on separate lines
         if len(self.collisions) > 0:
             element_string = "           Collides with element(s):"
-            for collision in self.collisions[self.index]:
+            for collision in self.collisions:
                 element_string += " {0:d}".format(collision)
             print(element_string)
 
         if len(self.duplicates) > 0:
             element_string = "           Duplicates element(s):"
-            for duplicate in self.duplicates[self.index]:
+            for duplicate in self.duplicates:
                 element_string += " {0:d}".format(duplicate)
             print(element_string)
 
@@ -433,6 +537,7 @@ class FfffElement:
         Print an element header's TFTF info
         """
         if self.element_type != FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
+            self.get_tftf()
             self.tftf_blob.display("element [{0:d}]".format(self.index), "  ")
             self.tftf_blob.display_data("element [{0:d}]".
                                         format(self.index), "  ")
@@ -444,7 +549,7 @@ class FfffElement:
                           self.element_short_name(self.element_type))
 
         # Dump the element starts
-        if self.tftf_blob:
+        if self.get_tftf():
             # We've got a TFTF, pass that on to TFTF to display
             self.tftf_blob.write_map(wf, self.element_location, elt_name)
         elif self.element_type != FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
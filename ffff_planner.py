@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+## FFFF element layout planner
+#
+# create-ffff lets each element be pinned to a location (--eloc) or left
+# for the planner to place. The planner fits the unpinned elements into
+# the gaps between the pinned ones (and the FFFF header blocks) and after
+# them, so as to end the last element as early as possible: that minimizes
+# the image length (and so the number of erase blocks to be erased and
+# programmed) when it's taken from the elements, and the number of blocks
+# which need programming when it isn't.
+#
+# Among the layouts with the earliest end, the planner prefers the one
+# which places the elements in their given order nearest the headers, so
+# the elements which the boot ROM reads first (e.g., the stage 2 firmware,
+# listed first) are placed first, unless doing so would waste space.
+# An element may also have to be aligned to more than an erase block.
+
+from __future__ import print_function
+from util import next_boundary
+
+# Maximum number of partial layouts to consider before settling for the
+# best layout found so far (the search is exhaustive for the handful of
+# elements in a typical FFFF)
+PLANNER_SEARCH_LIMIT = 100000
+
+
+def plan_element_layout(requests, erase_block_size, location_min,
+                        location_max=0):
+    """Choose the locations of the unpinned elements of an FFFF
+
+    requests is a list of (location, length, alignment) tuples, one per
+    element, where location is 0 for an element to be placed by the
+    planner, and alignment is 0 for erase-block alignment. Elements are
+    placed between location_min (the end of the FFFF header blocks) and
+    location_max (the image length, or 0 for no limit).
+
+    Returns a list of the elements' locations, parallel to requests.
+    Raises ValueError if the unpinned elements don't fit.
+    """
+    locations = [location for location, _, _ in requests]
+    unpinned = [index for index, (location, _, _) in enumerate(requests)
+                if location == 0]
+    if not unpinned:
+        return locations
+
+    # Find the free space around the pinned elements, as a list of
+    # (start, end) extents...
+    free = []
+    start = location_min
+    for location, length, _ in sorted(requests):
+        if location == 0:
+            continue
+        if location > start:
+            free.append((start, location))
+        start = max(start, next_boundary(location + length,
+                                         erase_block_size))
+    # ...ending with the space after them, whose start is thus the end of
+    # the layout
+    free.append((start, location_max or None))
+
+    # Depth-first search over which unpinned element to place next, and in
+    # which free extent, starting with the lowest. Placing an element
+    # splits its extent into the space (if any) skipped to align it and the
+    # space after it. Only the first aligned address in each extent need be
+    # tried: sliding the elements of any layout down, lowest first, to the
+    # first aligned address of their extents gives a layout which is no
+    # longer, and which this search visits.
+    chosen = [None] * len(unpinned)
+    remaining = list(range(len(unpinned)))
+    best = {"key": None, "locations": None, "nodes": 0}
+
+    def place(depth):
+        best["nodes"] += 1
+        if best["nodes"] > PLANNER_SEARCH_LIMIT or \
+           (best["key"] is not None and free[-1][0] > best["key"][0]):
+            return
+        if depth == len(unpinned):
+            # Among equally short layouts, prefer the one which places the
+            # elements nearest the headers in their given order
+            key = (free[-1][0], tuple(chosen))
+            if best["key"] is None or key < best["key"]:
+                best["key"] = key
+                best["locations"] = list(chosen)
+            return
+        for position in range(len(remaining)):
+            element = remaining.pop(position)
+            _, length, alignment = requests[unpinned[element]]
+            alignment = max(alignment, erase_block_size)
+            for extent in range(len(free)):
+                start, end = free[extent]
+                location = next_boundary(start, alignment)
+                if end is not None and location + length > end:
+                    continue
+                split = [(next_boundary(location + length, erase_block_size),
+                          end)]
+                if location > start:
+                    split.insert(0, (start, location))
+                free[extent:extent + 1] = split
+                chosen[element] = location
+                place(depth + 1)
+                free[extent:extent + len(split)] = [(start, end)]
+            chosen[element] = None
+            remaining.insert(position, element)
+
+    place(0)
+    if best["locations"] is None:
+        raise ValueError("Unable to fit {0:d} element(s) of 0x{1:x} bytes "
+                         "into the image".format(
+                             len(unpinned),
+                             sum(requests[index][1] for index in unpinned)))
+    for index, location in zip(unpinned, best["locations"]):
+        locations[index] = location
+    return locations
+
+
+def get_layout_slack(extents, erase_block_size, location_max=0):
+    """Return the slack after each element of a layout
+
+    extents is a list of (location, length) tuples, one per element. The
+    slack of an element is the unused space between its end and the next
+    element (or the end of the image, if location_max is given, or else the
+    end of its last erase block, for the last element). Returns a list of
+    slacks, parallel to extents.
+    """
+    slack = [0] * len(extents)
+    order = sorted(range(len(extents)), key=lambda index: extents[index])
+    for position, index in enumerate(order):
+        location, length = extents[index]
+        if position + 1 < len(order):
+            limit = extents[order[position + 1]][0]
+        else:
+            limit = location_max or next_boundary(location + length,
+                                                  erase_block_size)
+        slack[index] = max(0, limit - (location + length))
+    return slack
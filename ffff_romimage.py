@@ -30,16 +30,21 @@
 
 from __future__ import print_function
 from string import rfind
-from struct import unpack_from
 from ffff_element import FFFF_MAX_HEADER_BLOCK_OFFSET, FFFF_SENTINEL, \
-    FFFF_HDR_OFF_TAIL_SENTINEL, \
-    FFFF_FILE_EXTENSION, FFFF_HDR_VALID, \
+    FFFF_FILE_EXTENSION, FFFF_HDR_VALID, FFFF_HDR_FIXED_STRUCT, \
+    FFFF_SENTINEL_STRUCT, \
     FFFF_HEADER_SIZE_MIN, FFFF_HEADER_SIZE_MAX, FFFF_HEADER_SIZE_DEFAULT, \
-    FFFF_HDR_LEN_FIXED_PART, FFFF_ELT_LENGTH, \
-    FFFF_RSVD_SIZE, FFFF_HDR_OFF_RESERVED
-from ffff import Ffff, get_header_block_size
+    get_ffff_layout
+from ffff import Ffff, get_header_block_size, locate_ffff_headers
 from util import is_power_of_2
+import hashlib
 import io
+import json
+import mmap
+
+# Per-erase-block digest manifests (see: FfffRomimage.get_block_digests)
+FFFF_MANIFEST_EXTENSION = ".digests"
+FFFF_MANIFEST_HASH_ALGORITHM = "sha256"
 
 
 # FFFF ROMimage representation (2x FFFF headers + Nx TFTF blobs)
@@ -56,6 +61,7 @@ class FfffRomimage:
         """
         # FFFF header fields
         self.header_size = FFFF_HEADER_SIZE_DEFAULT
+        self.layout = get_ffff_layout(self.header_size)
         self.ffff0 = None
         self.ffff1 = None
         self.ffff_buf = None
@@ -121,12 +127,23 @@ class FfffRomimage:
                           header_size)
         return True
 
-    def init_from_file(self, filename):
+    def init_from_file(self, filename, headers_only=False, use_mmap=False):
         """"FFFF post-constructor initializer to read an FFFF from file
 
         Distinct from "init" above, this reads in an existing FFFF file
         and parses it, returning a success flag. The FFFF ROMimage buffer
         is sized to the supplied file.
+
+        If headers_only is True, only the part of the file which can hold
+        the FFFF headers is read, and the elements' TFTFs are not parsed.
+        This is much faster for inspecting the headers of large images, but
+        the result can't be used to write or explode the image.
+
+        If use_mmap is True, the file is memory-mapped (copy-on-write, so
+        the headers can still be modified in memory) instead of being read,
+        and each element's TFTF is only parsed, in place, when it's needed
+        (see: FfffElement.get_tftf). Only the parts of a large image which
+        are actually used are then read.
         """
         if filename:
             # Try to open the file, and if that fails, try appending the
@@ -147,13 +164,24 @@ class FfffRomimage:
                 # Read the FFFF file.
                 rf.seek(0, 2)
                 read_size = rf.tell()
-
-                # Resize the buffer to hold the file
-                self.ffff_buf = bytearray(read_size)
-                rf.seek(0, 0)
-                rf.readinto(self.ffff_buf)
+                if use_mmap and read_size > 0:
+                    # Map the file (the map holds its own reference to the
+                    # file, so we can close ours)
+                    self.ffff_buf = mmap.mmap(rf.fileno(), 0,
+                                              access=mmap.ACCESS_COPY)
+                else:
+                    use_mmap = False
+                    if headers_only:
+                        read_size = min(read_size,
+                                        FFFF_MAX_HEADER_BLOCK_OFFSET +
+                                        FFFF_HEADER_SIZE_MAX)
+
+                    # Resize the buffer to hold the file
+                    self.ffff_buf = bytearray(read_size)
+                    rf.seek(0, 0)
+                    rf.readinto(self.ffff_buf)
                 rf.close()
-            except IOError:
+            except (IOError, mmap.error):
                 raise IOError("can't read {0:s}".format(filename))
 
             self.get_romimage_characteristics()
@@ -167,34 +195,23 @@ class FfffRomimage:
                               self.flash_image_length,
                               self.header_generation_number,
                               0)
-            self.ffff0.unpack()
-
-            # Scan for 2nd header
-            offset = self.get_header_block_size()
-            while offset < FFFF_MAX_HEADER_BLOCK_OFFSET:
-                # Unpack and validate the nose and tail sentinels
-                ffff_hdr = unpack_from("<16s", self.ffff_buf,
-                                       offset)
-                nose_sentinel = ffff_hdr[0]
-                ffff_hdr = unpack_from("<16s", self.ffff_buf,
-                                       offset +
-                                       FFFF_HDR_OFF_TAIL_SENTINEL)
-                tail_sentinel = ffff_hdr[0]
-
-                # Create the 2nd FFFF header/object?
-                if nose_sentinel == FFFF_SENTINEL and \
-                        tail_sentinel == FFFF_SENTINEL:
-                    self.ffff1 = Ffff(self.ffff_buf, offset,
-                                      self.flash_image_name,
-                                      self.flash_capacity,
-                                      self.erase_block_size,
-                                      self.flash_image_length,
-                                      self.header_generation_number,
-                                      0)
-                    self.ffff1.unpack()
-                    break
-                else:
-                    offset <<= 1
+            self.ffff0.unpack(not headers_only, use_mmap)
+
+            # Find the 2nd header: the nearest candidate beyond the 1st
+            # header block (see: locate_ffff_headers)
+            header_block_size = self.get_header_block_size()
+            offsets = [candidate["offset"] for candidate in
+                       locate_ffff_headers(self.ffff_buf)
+                       if candidate["offset"] >= header_block_size]
+            if offsets:
+                self.ffff1 = Ffff(self.ffff_buf, min(offsets),
+                                  self.flash_image_name,
+                                  self.flash_capacity,
+                                  self.erase_block_size,
+                                  self.flash_image_length,
+                                  self.header_generation_number,
+                                  0)
+                self.ffff1.unpack(not headers_only, use_mmap)
         else:
             raise ValueError("no file specified")
 
@@ -210,34 +227,16 @@ class FfffRomimage:
 
         Because we have variable-size FFFF headers, we need to recalculate the
         number of entries in the section table, and the offsets to all fields
-        which follow.
+        which follow (see: FfffLayout).
         """
-        global FFFF_HDR_NUM_ELEMENTS, FFFF_HDR_LEN_ELEMENT_TBL, \
-            FFFF_HDR_NUM_RESERVED, FFFF_HDR_LEN_RESERVED, \
-            FFFF_HDR_OFF_RESERVED, FFFF_RSVD_SIZE, FFFF_HDR_OFF_TAIL_SENTINEL
-        # TFTF section table and derived lengths
-        FFFF_HDR_NUM_ELEMENTS = \
-            ((self.header_size - FFFF_HDR_LEN_FIXED_PART) // FFFF_ELT_LENGTH)
-        FFFF_HDR_LEN_ELEMENT_TBL = (FFFF_HDR_NUM_ELEMENTS * FFFF_ELT_LENGTH)
-
-        FFFF_HDR_LEN_RESERVED = (self.header_size -
-                                (FFFF_HDR_LEN_FIXED_PART +
-                                 FFFF_HDR_LEN_ELEMENT_TBL))
-        FFFF_HDR_NUM_RESERVED = FFFF_HDR_LEN_RESERVED / FFFF_RSVD_SIZE
-        self.reserved = [0] * FFFF_HDR_NUM_RESERVED
-
-        # Offsets to fields following the section table
-        FFFF_HDR_OFF_ELEMENT_TBL = (FFFF_HDR_OFF_RESERVED +
-                                    FFFF_HDR_LEN_RESERVED)
-        FFFF_HDR_OFF_TAIL_SENTINEL = (FFFF_HDR_OFF_ELEMENT_TBL +
-                                      FFFF_HDR_LEN_ELEMENT_TBL)
+        self.layout = get_ffff_layout(self.header_size)
 
     def get_romimage_characteristics(self):
         # Extract the ROMimage size and characteritics from the first FFFF
         # header in the buffer.
 
         # Unpack the fixed part of the header
-        ffff_hdr = unpack_from("<16s16s48sLLLLL", self.ffff_buf)
+        ffff_hdr = FFFF_HDR_FIXED_STRUCT.unpack_from(self.ffff_buf, 0)
         sentinel = ffff_hdr[0]
         self.timestamp = ffff_hdr[1]
         self.flash_image_name = ffff_hdr[2]
@@ -250,11 +249,14 @@ class FfffRomimage:
         # Because we have variable-size FFFF headers, we need to recalculate
         # the number of entries in the section table, and the offsets to all
         # fields which follow.
+        if (self.header_size < FFFF_HEADER_SIZE_MIN) or \
+           (self.header_size > FFFF_HEADER_SIZE_MAX):
+            raise ValueError("header_size is out of range")
         self.recalculate_header_offsets()
 
         # Unpack the 2nd sentinel at the tail
-        ffff_hdr = unpack_from("<16s", self.ffff_buf,
-                               FFFF_HDR_OFF_TAIL_SENTINEL)
+        ffff_hdr = FFFF_SENTINEL_STRUCT.unpack_from(
+            self.ffff_buf, self.layout.off_tail_sentinel)
         tail_sentinel = ffff_hdr[0]
 
         # Verify the sentinels
@@ -274,10 +276,16 @@ class FfffRomimage:
 
     def add_element(self, element_type, element_class, element_id,
                     element_length, element_location, element_generation,
-                    filename):
+                    filename, alignment=0):
         # Add a new element to the element table but don't load the
         # TFTF file into the ROMimage buffer.  This is called for FFFF
         # creation, and adds the element to both FFFF headers.
+        #
+        # Both headers describe the same element at the same location in
+        # the shared ROMimage buffer, so only the first one copies the
+        # TFTF into the buffer. (The TFTF itself is read only once, via
+        # the TFTF cache.) An element_location of 0 leaves the element to
+        # be placed by post_process, at a multiple of alignment (if given).
         if self.ffff0 and self.ffff1:
             return \
                 self.ffff0.add_element(element_type,
@@ -286,14 +294,18 @@ class FfffRomimage:
                                        element_length,
                                        element_location,
                                        element_generation,
-                                       filename) and \
+                                       filename,
+                                       alignment=alignment) and \
                 self.ffff1.add_element(element_type,
                                        element_class,
                                        element_id,
                                        element_length,
                                        element_location,
                                        element_generation,
-                                       filename)
+                                       filename,
+                                       self.ffff1.ffff_buf is not
+                                       self.ffff0.ffff_buf,
+                                       alignment)
         else:
             raise ValueError("No FFFF in which to add element")
 
@@ -319,6 +331,16 @@ class FfffRomimage:
         else:
             raise ValueError("No FFFF to display")
 
+    def to_dict(self):
+        """Return the FFFF headers (and elements) as a dictionary"""
+        headers = []
+        for ffff in (self.ffff0, self.ffff1):
+            if ffff:
+                headers.append(ffff.to_dict())
+        return {"flash_image_length": self.flash_image_length,
+                "header_size": self.header_size,
+                "headers": headers}
+
     def write(self, out_filename):
         """Create the FFFF file
 
@@ -342,6 +364,42 @@ class FfffRomimage:
             print("Wrote", out_filename)
             return True
 
+    def get_block_digests(self,
+                          hash_algorithm=FFFF_MANIFEST_HASH_ALGORITHM):
+        """Return a manifest of per-erase-block digests
+
+        The manifest is a JSON-able dictionary with a (hex) digest of each
+        erase block of the image, so that two images (or an image and an
+        earlier manifest of it, e.g. of what a device was last flashed
+        with) can be compared block by block (see: ffff_delta) without
+        holding on to, or re-reading, the unchanged one.
+        """
+        block_size = self.erase_block_size
+        image_length = len(self.ffff_buf)
+        blocks = []
+        for offset in range(0, image_length, block_size):
+            digest = hashlib.new(hash_algorithm)
+            digest.update(self.ffff_buf[offset:offset + block_size])
+            blocks.append(digest.hexdigest())
+        return {"hash_algorithm": hash_algorithm,
+                "erase_block_size": block_size,
+                "image_length": image_length,
+                "blocks": blocks}
+
+    def write_manifest(self, ffff_filename):
+        """Write the per-erase-block digest manifest for an FFFF file
+
+        The manifest (see: get_block_digests) is written alongside the FFFF
+        file, with FFFF_MANIFEST_EXTENSION appended to its name. Returns the
+        manifest's filename.
+        """
+        manifest_filename = ffff_filename + FFFF_MANIFEST_EXTENSION
+        with open(manifest_filename, 'w') as wf:
+            json.dump(self.get_block_digests(), wf, sort_keys=True,
+                      indent=2, separators=(",", ": "))
+            wf.write("\n")
+        return manifest_filename
+
     def explode(self, root_filename=None):
         """Write out the component elements
 
@@ -387,3 +445,18 @@ class FfffRomimage:
                 self.ffff1.write_map_elements(wf, 0, "ffff[1]")
         else:
             raise ValueError("No FFFF to display")
+
+
+def read_ffff_manifest(filename):
+    """Read a per-erase-block digest manifest (see: write_manifest)
+
+    Raises IOError if it can't be read, and ValueError if it's malformed.
+    """
+    with open(filename, 'r') as rf:
+        manifest = json.load(rf)
+    if not isinstance(manifest, dict) or \
+       not all(key in manifest for key in ("hash_algorithm",
+                                           "erase_block_size",
+                                           "image_length", "blocks")):
+        raise ValueError("{0:s} is not an FFFF manifest".format(filename))
+    return manifest
@@ -0,0 +1,230 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+## Erase-block occupancy maps of FFFF images and flash dumps
+#
+# An occupancy map classifies each erase block of a flash image as holding
+# (part of) an FFFF header or element, or, for blocks outside those, as
+# erased (all 0xff), zeroed or stray data (e.g., left over from an earlier
+# image). It's meant for auditing images and dumps before flashing them,
+# so it only reads the FFFF headers and each unclaimed block once, and
+# never parses the elements' TFTFs.
+
+from __future__ import print_function
+import io
+import mmap
+from struct import error as struct_error
+from ffff import Ffff, locate_ffff_headers
+from ffff_element import FFFF_ELEMENT_END_OF_ELEMENT_TABLE, \
+    element_short_names
+from ffff_romimage import FfffRomimage
+from util import is_constant_fill, is_power_of_2
+
+# Erase block classes
+OCCUPANCY_ERASED = "erased"
+OCCUPANCY_ZERO = "zero"
+OCCUPANCY_HEADER = "header"
+OCCUPANCY_ELEMENT = "element"
+OCCUPANCY_STRAY = "stray"
+
+OCCUPANCY_CLASSES = (OCCUPANCY_HEADER, OCCUPANCY_ELEMENT, OCCUPANCY_ERASED,
+                     OCCUPANCY_ZERO, OCCUPANCY_STRAY)
+
+
+def classify_block(data):
+    """Classify an erase block which isn't part of a header or element"""
+    if is_constant_fill(data, 0xff):
+        return OCCUPANCY_ERASED
+    elif is_constant_fill(data, 0):
+        return OCCUPANCY_ZERO
+    return OCCUPANCY_STRAY
+
+
+def get_romimage_extents(romimage):
+    """Return the extents of an FFFF ROMimage's headers and elements
+
+    Returns a list of (start, length, occupancy, label) tuples, one per
+    FFFF header and one per distinct element (both headers normally
+    describe the same elements).
+    """
+    return get_header_extents([("ffff[0]", romimage.ffff0),
+                               ("ffff[1]", romimage.ffff1)])
+
+
+def get_header_extents(headers):
+    """Return the extents of a list of FFFF headers and their elements
+
+    headers is a list of (label, Ffff) tuples, where the Ffff may be None.
+    Returns a list of extents, as for get_romimage_extents.
+    """
+    extents = []
+    seen = set()
+    for name, ffff in headers:
+        if not ffff:
+            continue
+        extents.append((ffff.header_offset, ffff.header_size,
+                        OCCUPANCY_HEADER, name))
+        for element in ffff.elements:
+            if element.element_type == FFFF_ELEMENT_END_OF_ELEMENT_TABLE:
+                break
+            extent = (element.element_location, element.element_length)
+            if extent in seen:
+                continue
+            seen.add(extent)
+            label = "element {0:d} ({1:s})".format(
+                element.index,
+                element_short_names.get(element.element_type, "?"))
+            extents.append(extent + (OCCUPANCY_ELEMENT, label))
+    return extents
+
+
+def get_occupancy_map(buf, erase_block_size, extents=()):
+    """Classify each erase block of a flash image
+
+    buf is the flash image (e.g., a bytearray or mmap) and extents is a
+    list of (start, length, occupancy, label) tuples for its headers and
+    elements (see: get_romimage_extents). Returns a list, with one entry per
+    erase block, of (occupancy, label) tuples. A block which is (partly)
+    covered by an extent takes the extent's occupancy and label, headers
+    winning over elements, and the others are classified by their contents
+    (see: classify_block), with no label.
+    """
+    if not is_power_of_2(erase_block_size):
+        raise ValueError("Erase block size must be 2**n")
+    buf_size = len(buf)
+    num_blocks = (buf_size + erase_block_size - 1) // erase_block_size
+    occupancy_map = [None] * num_blocks
+
+    # Mark the blocks covered by the elements, then the headers
+    for occupancy in (OCCUPANCY_ELEMENT, OCCUPANCY_HEADER):
+        for start, length, extent_occupancy, label in extents:
+            if extent_occupancy != occupancy or length <= 0:
+                continue
+            first = start // erase_block_size
+            last = min((start + length - 1) // erase_block_size,
+                       num_blocks - 1)
+            for block in range(first, last + 1):
+                occupancy_map[block] = (occupancy, label)
+
+    # Classify the rest by their contents
+    for block in range(num_blocks):
+        if not occupancy_map[block]:
+            start = block * erase_block_size
+            data = buf[start:min(start + erase_block_size, buf_size)]
+            occupancy_map[block] = (classify_block(data), None)
+    return occupancy_map
+
+
+def get_occupancy_runs(occupancy_map, erase_block_size):
+    """Merge an occupancy map into runs of like blocks
+
+    Returns a list of dictionaries, one for each run of consecutive erase
+    blocks with the same occupancy and label.
+    """
+    runs = []
+    for block, (occupancy, label) in enumerate(occupancy_map):
+        if runs and runs[-1]["occupancy"] == occupancy and \
+                runs[-1]["label"] == label:
+            runs[-1]["blocks"] += 1
+            runs[-1]["length"] += erase_block_size
+        else:
+            runs.append({"offset": block * erase_block_size,
+                         "length": erase_block_size,
+                         "blocks": 1,
+                         "occupancy": occupancy,
+                         "label": label})
+    return runs
+
+
+def count_occupancy(occupancy_map):
+    """Return the number of erase blocks of each class in a map"""
+    counts = dict((occupancy, 0) for occupancy in OCCUPANCY_CLASSES)
+    for occupancy, _ in occupancy_map:
+        counts[occupancy] += 1
+    return counts
+
+
+def get_candidate_header(buf, candidate):
+    """Parse a candidate FFFF header, without its elements' TFTFs
+
+    candidate is one of the dictionaries returned by locate_ffff_headers.
+    """
+    ffff = Ffff(buf, candidate["offset"], candidate["flash_image_name"],
+                candidate["flash_capacity"], candidate["erase_block_size"],
+                candidate["flash_image_length"], candidate["generation"],
+                candidate["header_size"])
+    ffff.unpack(load_data=False)
+    return ffff
+
+
+def get_file_occupancy(filename, erase_block_size=None):
+    """Return the occupancy map of an FFFF file or flash dump
+
+    Returns a dictionary describing the file, its erase block size and the
+    runs of its occupancy map (see: get_occupancy_runs). The erase block
+    size is taken from the FFFF header unless erase_block_size is given.
+
+    If the first FFFF header is damaged, the best remaining candidate
+    header (see: locate_ffff_headers) is used instead, so a dump with one
+    good header copy is still mapped. If there is none, a file is only
+    classified by its contents alone (e.g., a dump of an erased flash) if
+    erase_block_size is given.
+
+    Raises IOError or ValueError if the file can't be mapped.
+    """
+    romimage = FfffRomimage()
+    try:
+        romimage.init_from_file(filename, use_mmap=True)
+        buf = romimage.ffff_buf
+        extents = get_romimage_extents(romimage)
+        erase_block_size = erase_block_size or romimage.erase_block_size
+    except (ValueError, struct_error):
+        # (The first header is damaged, or it's not an FFFF, or too short
+        # to be one)
+        with io.open(filename, 'rb') as rf:
+            buf = mmap.mmap(rf.fileno(), 0, access=mmap.ACCESS_READ)
+        candidates = [candidate for candidate in locate_ffff_headers(buf)
+                      if is_power_of_2(candidate["erase_block_size"])]
+        if candidates:
+            ffff = get_candidate_header(buf, candidates[0])
+            label = "ffff[{0:d}]".format(int(ffff.header_offset != 0))
+            extents = get_header_extents([(label, ffff)])
+            erase_block_size = erase_block_size or ffff.erase_block_size
+        elif erase_block_size:
+            extents = []
+        else:
+            raise ValueError("{0:s} is not an FFFF file".format(filename))
+
+    occupancy_map = get_occupancy_map(buf, erase_block_size, extents)
+    return {"file": filename,
+            "erase_block_size": erase_block_size,
+            "length": len(buf),
+            "counts": count_occupancy(occupancy_map),
+            "runs": get_occupancy_runs(occupancy_map, erase_block_size)}
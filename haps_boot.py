@@ -30,6 +30,9 @@
 
 ## Tool to automatically download an image into the HAPS board and boot it
 #
+# The serial, termios and Adafruit GPIO modules are only imported by the
+# functions which talk to the hardware, so that the JLink script helpers
+# can be used (and run-bootrom-tests started) without them.
 
 from __future__ import print_function
 from util import error
@@ -37,10 +40,6 @@ import os
 import subprocess
 import threading
 import Queue
-import serial
-import termios
-import Adafruit_GPIO as GPIO
-import Adafruit_GPIO.FT232H as FT232H
 
 # haps_monitor class "monitor" status values
 HAPS_MONITOR_TIMEOUT = 0
@@ -194,6 +193,7 @@ def haps_board_ready(chipit_name):
     # Monitor the ChipIT TTY and return when we see the "HAPS62>" prompt.
     # Will actively probe for the prompt after a while.
     # Returns True when synchronized, False if not
+    import serial
     have_prompt = False
     issued_boot_msg = False
 
@@ -247,6 +247,8 @@ def haps_board_ready(chipit_name):
 def init_adafruit_ft232h():
     # Apply or remove the reset from the SPIROM daughterboard
     # via a GPIO on the AdaFruit FT232H SPI/I2C/UART/GPIO breakout board.
+    import Adafruit_GPIO as GPIO
+    import Adafruit_GPIO.FT232H as FT232H
     global ft232h, adafruit_initialized
 
     if not adafruit_initialized:
@@ -275,6 +277,7 @@ def init_adafruit_ft232h():
 def reset_spirom_daughterboard_adafruit_ft232h(apply_reset):
     # Apply or remove the reset from the SPIROM daughterboard
     # via a GPIO on the AdaFruit FT232H SPI/I2C/UART/GPIO breakout board.
+    import Adafruit_GPIO as GPIO
     global ft232h, adafruit_initialized
     if not adafruit_initialized:
         init_adafruit_ft232h()
@@ -397,6 +400,7 @@ class WorkerThread(threading.Thread):
         if os.name != "posix":
             raise ValueError("Can only be run on Posix systems")
             return
+        import termios
 
         buffer = ""
         # While PySerial would be preferable and more machine-independant,
@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+## Installs the bootrom-tools scripts, and their modules as a library
+#
+# The scripts can also be run in place, from a checkout.
+
+from setuptools import setup
+
+setup(
+    name="bootrom-tools",
+    version="1.0",
+    description="Tools for building and signing TFTF and FFFF images",
+    license="BSD",
+    py_modules=[
+        "build_cache",
+        "chklog",
+        "common_args",
+        "crypto_backend",
+        "efuse",
+        "ffff",
+        "ffff_delta",
+        "ffff_element",
+        "ffff_planner",
+        "ffff_romimage",
+        "flash_occupancy",
+        "haps_boot",
+        "signature_block",
+        "signature_common",
+        "signature_verify",
+        "signing_agent",
+        "tftf",
+        "util",
+    ],
+    scripts=[
+        "apply-ffff-delta",
+        "audit-flash",
+        "autoboot",
+        "benchmark-crypto",
+        "benchmark-startup",
+        "benchmark-tftf",
+        "check-log",
+        "check-logs",
+        "create-bootrom-test-suite",
+        "create-dual-image",
+        "create-ffff",
+        "create-tftf",
+        "delta-ffff",
+        "diff-tftf",
+        "display-ffff",
+        "display-tftf",
+        "dmefilter",
+        "hexpatch",
+        "locate-ffff",
+        "pem2arakeys",
+        "response",
+        "run-bootrom-tests",
+        "sign-tftf",
+        "signing-agent",
+        "verify-ffff",
+        "verify-tftf",
+    ],
+    extras_require={
+        "elf": ["pyelftools"],
+        "m2crypto": ["M2Crypto"],
+        "cryptography": ["cryptography"],
+        "haps": ["pyserial", "Adafruit_GPIO"],
+    },
+)
@@ -42,6 +42,10 @@ TFTF_SIGNATURE_ALGORITHMS = \
 TFTF_SIGNATURE_ALGORITHM_NAMES = \
     {TFTF_SIGNATURE_ALGORITHM_RSA_2048_SHA_256: "rsa2048-sha256"}
 
+# Signature lengths (in bytes), by algorithm
+TFTF_SIGNATURE_LENGTHS = \
+    {TFTF_SIGNATURE_ALGORITHM_RSA_2048_SHA_256: 256}
+
 # Recognized key types (--type)
 KEY_TYPE_UNKNOWN = 0
 KEY_TYPE_S2FSK = 1
@@ -100,6 +104,18 @@ def get_key_filename(filename, private):
     return None
 
 
+def get_public_key_filename(key_filename):
+    """ Find the public key file alongside a private key file
+
+    Returns the public key filename if found, None if not found
+    """
+    name = rchop(key_filename, ".private.pem")
+    name = rchop(name, ".pem") + ".public.pem"
+    if name != key_filename and os.path.isfile(name):
+        return name
+    return None
+
+
 def format_key_name(key_format, key_filename, key_type,
                     signature_algorithm, suffix):
     """ Derive the name of the key from the key's filename """
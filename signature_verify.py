@@ -0,0 +1,247 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+## TFTF signature verification
+#
+# Checks the signature sections of TFTFs (stand-alone files, or FFFF
+# elements) against the public keys in a key directory. A signature's key
+# is found by its key name, whose left half is the key's filename (see:
+# signature_common.format_key_name), so the key for "key1@s2fsk.example.com"
+# is key1.public.pem or key1.pem.
+#
+# The verify_*_job functions are the workers for verify-tftf and
+# verify-ffff, which run them in parallel (see: util.parallel_map).
+
+from __future__ import print_function
+import os
+from crypto_backend import get_crypto_backend, CryptoError
+from signature_block import SignatureBlock, TFTF_SIGNATURE_LEN_FIXED_PART
+from signature_common import TFTF_SIGNATURE_ALGORITHM_RSA_2048_SHA_256, \
+    TFTF_SIGNATURE_ALGORITHM_NAMES
+from tftf import Tftf, TFTF_SENTINEL, TFTF_SECTION_TYPE_SIGNATURE, \
+    TFTF_SECTION_TYPE_END_OF_DESCRIPTORS
+from util import header_string
+
+# Signature verification results
+SIGNATURE_VALID = "valid"
+SIGNATURE_INVALID = "invalid"
+SIGNATURE_UNKNOWN_KEY = "unknown key"
+SIGNATURE_UNKNOWN_ALGORITHM = "unknown algorithm"
+SIGNATURE_MALFORMED = "malformed"
+
+# TFTF verification results (in addition to the above)
+TFTF_UNSIGNED = "unsigned"
+TFTF_ERROR = "error"
+
+# Hash algorithms (M2Crypto/hashlib names) by signature algorithm
+signature_hash_algorithms = {
+    TFTF_SIGNATURE_ALGORITHM_RSA_2048_SHA_256: "sha256",
+}
+
+# Public key filename extensions, in order of preference
+public_key_extensions = (".public.pem", ".pem")
+
+# Per-process cache of PublicKeyCaches, by key directory and crypto backend
+key_caches = {}
+
+
+class PublicKeyCache(object):
+    """Public keys from a key directory, loaded as needed, by key name"""
+
+    def __init__(self, key_dir, crypto):
+        self.key_dir = key_dir
+        self.crypto = crypto
+        self.keys = {}
+
+    def get_key(self, key_name):
+        """Return the public key (see: crypto_backend) for key_name, or None"""
+        if key_name in self.keys:
+            return self.keys[key_name]
+
+        key = None
+        key_filename = key_name.split("@")[0]
+        # (Don't let a key name escape the key directory)
+        if key_filename and os.path.basename(key_filename) == key_filename:
+            for extension in public_key_extensions:
+                pathname = os.path.join(self.key_dir,
+                                        key_filename + extension)
+                if os.path.isfile(pathname):
+                    try:
+                        key = self.crypto.load_public_key(pathname)
+                    except CryptoError:
+                        key = None
+                    break
+        self.keys[key_name] = key
+        return key
+
+
+def get_key_cache(key_dir, crypto_name=None):
+    """Return this process's PublicKeyCache for a key directory
+
+    crypto_name names the crypto backend (see: get_crypto_backend).
+    """
+    if (key_dir, crypto_name) not in key_caches:
+        key_caches[(key_dir, crypto_name)] = \
+            PublicKeyCache(key_dir, get_crypto_backend(crypto_name))
+    return key_caches[(key_dir, crypto_name)]
+
+
+def verify_signature(signature_block, digests, key_cache):
+    # Verify a signature block, given the digests of the signed blob for
+    # each hash algorithm, and return the result.
+    hash_algorithm = \
+        signature_hash_algorithms.get(signature_block.signature_type)
+    if not hash_algorithm:
+        return SIGNATURE_UNKNOWN_ALGORITHM
+    key = key_cache.get_key(header_string(signature_block.key_name))
+    if not key:
+        return SIGNATURE_UNKNOWN_KEY
+    if key.verify(digests[hash_algorithm], bytes(signature_block.signature),
+                  hash_algorithm):
+        return SIGNATURE_VALID
+    return SIGNATURE_INVALID
+
+
+def verify_tftf(tftf, key_cache):
+    """Verify the signatures in a TFTF
+
+    Returns a list of dictionaries, one per signature section, giving the
+    section index, key name, signature algorithm and result (SIGNATURE_xxx).
+
+    Every signature covers the same blob: the TFTF header up to the first
+    signature descriptor, and the sections before it (see: sign-tftf). The
+    blob is digested (once per hash algorithm) as it is stored, without
+    repacking the header.
+    """
+    signed_index = tftf.find_first_section(TFTF_SECTION_TYPE_SIGNATURE)
+    digests = {}
+    results = []
+    offset = tftf.header_size
+    for index, section in enumerate(tftf.sections):
+        if section.section_type == TFTF_SECTION_TYPE_END_OF_DESCRIPTORS:
+            break
+        start = offset
+        offset += section.section_length
+        if section.section_type != TFTF_SECTION_TYPE_SIGNATURE:
+            continue
+
+        result = {"section": index}
+        results.append(result)
+        if section.section_length < TFTF_SIGNATURE_LEN_FIXED_PART or \
+           offset > len(tftf.tftf_buf):
+            result["result"] = SIGNATURE_MALFORMED
+            continue
+        signature_block = SignatureBlock(tftf.tftf_buf[start:offset])
+        result["key_name"] = header_string(signature_block.key_name)
+        result["algorithm"] = TFTF_SIGNATURE_ALGORITHM_NAMES.get(
+            signature_block.signature_type, signature_block.signature_type)
+        if signature_block.length > section.section_length:
+            result["result"] = SIGNATURE_MALFORMED
+            continue
+
+        hash_algorithm = \
+            signature_hash_algorithms.get(signature_block.signature_type)
+        if hash_algorithm and hash_algorithm not in digests:
+            digest = key_cache.crypto.new_digest(hash_algorithm)
+            for chunk in tftf.get_signable_chunks(signed_index, flush=False):
+                digest.update(chunk)
+            digests[hash_algorithm] = digest.digest()
+        result["result"] = verify_signature(signature_block, digests,
+                                            key_cache)
+    return results
+
+
+def get_verification_record(tftf, key_dir, crypto_name):
+    # Verify a TFTF, returning a JSON-able record of the results, with an
+    # overall "result"
+    if tftf.sentinel != TFTF_SENTINEL:
+        return {"result": TFTF_ERROR, "error": "not a TFTF"}
+    signatures = verify_tftf(tftf, get_key_cache(key_dir, crypto_name))
+    if not signatures:
+        result = TFTF_UNSIGNED
+    elif all(signature["result"] == SIGNATURE_VALID
+             for signature in signatures):
+        result = SIGNATURE_VALID
+    else:
+        result = SIGNATURE_INVALID
+    return {"result": result, "signatures": signatures}
+
+
+def verify_tftf_job(job):
+    """Verify a TFTF file (the verify-tftf worker)
+
+    job is a (filename, key_dir, crypto_name) tuple. Returns a JSON-able
+    record of the results.
+    """
+    filename, key_dir, crypto_name = job
+    try:
+        with open(filename, 'rb') as rf:
+            tftf = Tftf(0, None)
+            tftf.load_tftf_from_buffer(bytearray(rf.read()))
+        record = get_verification_record(tftf, key_dir, crypto_name)
+    except Exception as e:
+        record = {"result": TFTF_ERROR, "error": str(e)}
+    record["file"] = filename
+    return record
+
+
+def verify_ffff_element_job(job):
+    """Verify an FFFF element's TFTF (the verify-ffff worker)
+
+    job is a (filename, location, length, key_dir, crypto_name) tuple. Only
+    the element itself is read from the FFFF file. Returns a JSON-able
+    record of the results.
+    """
+    filename, location, length, key_dir, crypto_name = job
+    try:
+        with open(filename, 'rb') as rf:
+            rf.seek(location)
+            buf = bytearray(rf.read(length))
+        if len(buf) != length:
+            raise IOError("element extends past the end of the file")
+        tftf = Tftf(0, None)
+        tftf.load_tftf_from_buffer(buf)
+        record = get_verification_record(tftf, key_dir, crypto_name)
+    except Exception as e:
+        record = {"result": TFTF_ERROR, "error": str(e)}
+    record["file"] = filename
+    return record
+
+
+def display_verification_record(record, name):
+    """Display the results of verifying a TFTF"""
+    print("{0:s}: {1:s}".format(name, record["result"]))
+    if "error" in record:
+        print("    {0:s}".format(record["error"]))
+    for signature in record.get("signatures", []):
+        print("    section [{0:d}] {1:s}: {2:s}".format(
+              signature["section"], signature.get("key_name", "?"),
+              signature["result"]))
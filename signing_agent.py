@@ -0,0 +1,210 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+## Signing agent protocol
+#
+# The signing-agent script holds unlocked private keys, indexed by key name
+# (see: signature_common.format_key_name), and signs digests for clients
+# such as "sign-tftf --agent", so that they needn't load the keys or handle
+# their passphrases. (Much like ssh-agent.)
+#
+# The agent listens on a Unix socket, named by the TFTF_SIGNING_AGENT
+# environment variable. Requests and responses are JSON objects, one per
+# line, with binary values hex-encoded:
+#
+#   {"op": "keys"}
+#       -> {"keys": {<key name>: <public key fingerprint>, ...}}
+#   {"op": "sign", "key_name": ..., "hash_algorithm": ..., "digest": ...}
+#       -> {"signature": ...}
+#
+# A failed request gets an {"error": <message>} response.
+
+from __future__ import print_function
+import os
+import binascii
+import json
+import socket
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+# Environment variable naming the agent's socket
+SIGNING_AGENT_ENV = "TFTF_SIGNING_AGENT"
+SIGNING_AGENT_PID_ENV = "TFTF_SIGNING_AGENT_PID"
+
+
+class SigningAgentError(Exception):
+    """A signing agent is unavailable or refused a request"""
+    pass
+
+
+def key_fingerprint(key):
+    """Return a fingerprint of a private key's public part"""
+    return key.public_key().fingerprint()
+
+
+def send_message(wfile, message):
+    # Send a protocol message (a dictionary) as a line of JSON
+    wfile.write((json.dumps(message, sort_keys=True) + "\n").encode("utf-8"))
+    wfile.flush()
+
+
+def receive_message(rfile):
+    # Receive a protocol message, returning None at end-of-file
+    line = rfile.readline()
+    if not line:
+        return None
+    message = json.loads(line.decode("utf-8"))
+    if not isinstance(message, dict):
+        raise ValueError("Malformed signing agent message")
+    return message
+
+
+class SigningAgentHandler(socketserver.StreamRequestHandler):
+    """Handler for one signing agent client connection"""
+
+    def handle(self):
+        while True:
+            try:
+                request = receive_message(self.rfile)
+            except ValueError as e:
+                send_message(self.wfile, {"error": str(e)})
+                return
+            if request is None:
+                return
+            send_message(self.wfile, self.server.handle_agent_request(request))
+
+
+class SigningAgentServer(socketserver.ThreadingMixIn,
+                         socketserver.UnixStreamServer):
+    """Signing agent, serving a set of keys on a Unix socket"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, keys):
+        """Constructor
+
+        keys is a dictionary of unlocked private keys (see: crypto_backend),
+        indexed by key name. The socket is created (accessible only by its
+        owner) but not served until serve_forever is called.
+        """
+        self.keys = keys
+        old_umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, socket_path,
+                                                   SigningAgentHandler)
+        finally:
+            os.umask(old_umask)
+
+    def handle_agent_request(self, request):
+        # Process a protocol request, returning the response
+        op = request.get("op")
+        if op == "keys":
+            return {"keys": dict((key_name, key_fingerprint(key))
+                                 for key_name, key in self.keys.items())}
+        elif op == "sign":
+            key = self.keys.get(request.get("key_name"))
+            if not key:
+                return {"error": "No key named {0}".
+                        format(request.get("key_name"))}
+            try:
+                digest = binascii.unhexlify(request["digest"])
+                signature = key.sign(digest, str(request["hash_algorithm"]))
+            except Exception as e:
+                return {"error": "Unable to sign ({0})".format(e)}
+            return {"signature": binascii.hexlify(signature).decode("ascii")}
+        else:
+            return {"error": "Unknown request {0}".format(op)}
+
+
+class SigningAgentClient(object):
+    """Connection to a signing agent"""
+
+    def __init__(self, socket_path=None):
+        """Connect to the agent at socket_path (default: $TFTF_SIGNING_AGENT)
+
+        Raises SigningAgentError if there is no agent.
+        """
+        socket_path = socket_path or os.environ.get(SIGNING_AGENT_ENV)
+        if not socket_path:
+            raise SigningAgentError("No signing agent (${0:s} is not set)".
+                                    format(SIGNING_AGENT_ENV))
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(socket_path)
+        except socket.error as e:
+            self.sock.close()
+            raise SigningAgentError("Can't connect to signing agent "
+                                    "{0} ({1})".format(socket_path, e))
+        self.rfile = self.sock.makefile("rb")
+        self.wfile = self.sock.makefile("wb")
+
+    def request(self, request):
+        # Send a request to the agent and return its response
+        try:
+            send_message(self.wfile, request)
+            response = receive_message(self.rfile)
+        except (socket.error, ValueError) as e:
+            raise SigningAgentError("Signing agent failed ({0})".format(e))
+        if response is None:
+            raise SigningAgentError("Signing agent closed the connection")
+        if "error" in response:
+            raise SigningAgentError(response["error"])
+        return response
+
+    def list_keys(self):
+        """Return a dictionary of the agent's key fingerprints, by name"""
+        return self.request({"op": "keys"})["keys"]
+
+    def sign(self, key_name, digest, hash_algorithm):
+        """Have the agent sign a digest with one of its keys"""
+        response = self.request({
+            "op": "sign",
+            "key_name": key_name,
+            "hash_algorithm": hash_algorithm,
+            "digest": binascii.hexlify(digest).decode("ascii")})
+        return binascii.unhexlify(response["signature"])
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+
+class SigningAgentKey(object):
+    """Stand-in for a private key held by a signing agent"""
+
+    def __init__(self, client, key_name):
+        self.client = client
+        self.key_name = key_name
+
+    def sign(self, digest, hash_algorithm):
+        return self.client.sign(self.key_name, digest, hash_algorithm)
@@ -0,0 +1,67 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+## Shared fixture: a small FFFF image holding one TFTF element
+
+from __future__ import print_function
+import os
+import sys
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+from tftf import Tftf, TFTF_SECTION_TYPE_RAW_CODE
+from ffff_romimage import FfffRomimage
+from ffff_element import FFFF_ELEMENT_STAGE2_FIRMWARE_PACKAGE
+
+
+def make_ffff_image(work_dir, erase_block_size, element_location):
+    # Write a TFTF of 5000 bytes of code, and a 128KB FFFF image holding it
+    # as a stage 2 firmware element at element_location, in work_dir.
+    # Returns a (TFTF filename, FFFF filename) tuple.
+    code_name = os.path.join(work_dir, "code.bin")
+    with open(code_name, "wb") as wf:
+        wf.write(b"\xa5" * 5000)
+    tftf_name = os.path.join(work_dir, "code.tftf")
+    tftf = Tftf(512)
+    tftf.start_location = 0x10000000
+    tftf.add_section_from_file(TFTF_SECTION_TYPE_RAW_CODE, 0, 0,
+                               code_name, 0x10000000)
+    tftf.post_process()
+    tftf.write(tftf_name)
+
+    ffff_name = os.path.join(work_dir, "image.ffff")
+    romimage = FfffRomimage()
+    romimage.init("image", 0x20000, erase_block_size, 0x20000, 1,
+                  0x1000)
+    romimage.add_element(FFFF_ELEMENT_STAGE2_FIRMWARE_PACKAGE, 0, 1, 0,
+                         element_location, 0, tftf_name)
+    romimage.post_process()
+    romimage.write(ffff_name)
+    return (tftf_name, ffff_name)
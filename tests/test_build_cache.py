@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+from build_cache import SignatureCache
+from signature_common import TFTF_SIGNATURE_ALGORITHM_RSA_2048_SHA_256
+
+DIGEST = b"\x5a" * 32
+KEY_ID = "0123456789abcdef"
+KEY_NAME = "test@s2fsk.keys.projectara.com"
+ALGORITHM = TFTF_SIGNATURE_ALGORITHM_RSA_2048_SHA_256
+SIGNATURE = b"\xa5" * 256
+
+
+class SignatureCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = SignatureCache(self.cache_dir)
+        self.entry_name = self.cache.entry_name(DIGEST, KEY_ID, KEY_NAME,
+                                                ALGORITHM)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_hit(self):
+        self.cache.store(DIGEST, KEY_ID, KEY_NAME, ALGORITHM, SIGNATURE)
+        self.assertEqual(self.cache.fetch(DIGEST, KEY_ID, KEY_NAME,
+                                          ALGORITHM), SIGNATURE)
+        self.assertIsNone(self.cache.fetch(DIGEST, KEY_ID, "other",
+                                           ALGORITHM))
+
+    def test_truncated_entry_discarded(self):
+        self.cache.store(DIGEST, KEY_ID, KEY_NAME, ALGORITHM,
+                         SIGNATURE[:100])
+        self.assertIsNone(self.cache.fetch(DIGEST, KEY_ID, KEY_NAME,
+                                           ALGORITHM))
+        self.assertFalse(os.path.exists(self.entry_name))
+
+    def test_rejected_entry_discarded(self):
+        self.cache.store(DIGEST, KEY_ID, KEY_NAME, ALGORITHM, SIGNATURE)
+        self.assertIsNone(self.cache.fetch(DIGEST, KEY_ID, KEY_NAME,
+                                           ALGORITHM, lambda s: False))
+        self.assertFalse(os.path.exists(self.entry_name))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+from __future__ import print_function
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+import zlib
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+from tftf import Tftf, TFTF_SECTION_TYPE_COMPRESSED_DATA, \
+    TFTF_SECTION_TYPE_END_OF_DESCRIPTORS
+
+
+def write_elf(filename, load_address, contents, memsz):
+    # Write a minimal 32-bit little-endian ARM ELF executable with a single
+    # (read/write, non-executable) PT_LOAD segment holding contents, whose
+    # memory image is memsz bytes (i.e., with a NOBITS tail).
+    write_elf_segments(filename, load_address,
+                       [(load_address, contents, memsz)])
+
+
+def write_elf_segments(filename, entry_point, segments):
+    # Write a minimal ELF executable (see: write_elf) with a (read/write,
+    # non-executable) PT_LOAD segment for each (load address, contents,
+    # memsz) tuple in segments.
+    ehdr_len = 52
+    phdr_len = 32
+    ehdr = struct.pack("<4sBBBB8sHHLLLLLHHHHHH",
+                       b"\x7fELF", 1, 1, 1, 0, b"\0" * 8,
+                       2, 40, 1, entry_point, ehdr_len, 0, 0x05000000,
+                       ehdr_len, phdr_len, len(segments), 40, 0, 0)
+    offset = ehdr_len + phdr_len * len(segments)
+    phdrs = b""
+    for load_address, contents, memsz in segments:
+        phdrs += struct.pack("<LLLLLLLL",
+                             1, offset, load_address, load_address,
+                             len(contents), memsz, 6, 4)
+        offset += len(contents)
+    with open(filename, "wb") as wf:
+        wf.write(ehdr + phdrs +
+                 b"".join(contents for _, contents, _ in segments))
+
+
+class CompressedSegmentTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_bss_tail_expands_to_memsz(self):
+        # A compressed segment with a .bss tail must expand to the
+        # expanded_length recorded for it (p_memsz), not just p_filesz.
+        elf_name = os.path.join(self.work_dir, "bss.elf")
+        tftf_name = os.path.join(self.work_dir, "bss.tftf")
+        contents = b"\x5a" * 0x1000
+        memsz = 0x3000
+        write_elf(elf_name, 0x10000000, contents, memsz)
+        subprocess.check_call([sys.executable,
+                               os.path.join(TOOLS_DIR, "create-tftf"),
+                               "--elf-segments", elf_name,
+                               "--compress", "zlib",
+                               "--out", tftf_name])
+
+        tftf = Tftf(0, tftf_name)
+        section = tftf.sections[0]
+        self.assertEqual(section.section_type,
+                         TFTF_SECTION_TYPE_COMPRESSED_DATA)
+        self.assertEqual(section.expanded_length, memsz)
+        start = tftf.header_size
+        expanded = zlib.decompress(
+            bytes(tftf.tftf_buf[start:start + section.section_length]))
+        self.assertEqual(len(expanded), section.expanded_length)
+        self.assertEqual(expanded, contents + b"\0" * (memsz - len(contents)))
+
+
+class BssSegmentTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.elf_name = os.path.join(self.work_dir, "bss.elf")
+        self.tftf_name = os.path.join(self.work_dir, "bss.tftf")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def create_tftf(self):
+        return subprocess.call([sys.executable,
+                                os.path.join(TOOLS_DIR, "create-tftf"),
+                                "--elf-segments", self.elf_name,
+                                "--out", self.tftf_name],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+
+    def test_adjacent_bss_segment_extends_data(self):
+        # A file-less .bss segment following the data in memory becomes the
+        # data section's NOBITS tail
+        write_elf_segments(self.elf_name, 0x20000000,
+                           [(0x20000000, b"\x5a" * 0x100, 0x100),
+                            (0x20000100, b"", 0x2000)])
+        self.assertEqual(self.create_tftf(), 0)
+        tftf = Tftf(0, self.tftf_name)
+        section = tftf.sections[0]
+        self.assertEqual(section.section_length, 0x100)
+        self.assertEqual(section.expanded_length, 0x2100)
+        self.assertEqual(tftf.sections[1].section_type,
+                         TFTF_SECTION_TYPE_END_OF_DESCRIPTORS)
+
+    def test_separate_bss_segment(self):
+        # A file-less .bss segment elsewhere gets a zero-length section
+        write_elf_segments(self.elf_name, 0x20000000,
+                           [(0x20000000, b"\x5a" * 0x100, 0x100),
+                            (0x20001000, b"", 0x2000)])
+        self.assertEqual(self.create_tftf(), 0)
+        tftf = Tftf(0, self.tftf_name)
+        section = tftf.sections[1]
+        self.assertEqual(section.load_address, 0x20001000)
+        self.assertEqual(section.section_length, 0)
+        self.assertEqual(section.expanded_length, 0x2000)
+
+    def test_no_file_contents(self):
+        write_elf_segments(self.elf_name, 0x20000000,
+                           [(0x20000000, b"", 0x2000)])
+        process = subprocess.Popen([sys.executable,
+                                    os.path.join(TOOLS_DIR, "create-tftf"),
+                                    "--elf-segments", self.elf_name,
+                                    "--out", self.tftf_name],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        _, err = process.communicate()
+        self.assertNotEqual(process.returncode, 0)
+        self.assertIn(b"has no loadable segments", err)
+
+
+if __name__ == "__main__":
+    unittest.main()
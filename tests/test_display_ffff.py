@@ -0,0 +1,86 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+from __future__ import print_function
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+from ffff_image import make_ffff_image
+
+
+class DisplayFfffJsonTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.tftf_name, self.ffff_name = make_ffff_image(self.work_dir,
+                                                         0x1000, 0x4000)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_element_tftf_length(self):
+        # Each element's TFTF reports the length of the whole TFTF blob
+        output = subprocess.check_output(
+            [sys.executable, os.path.join(TOOLS_DIR, "display-ffff"),
+             "--json", self.ffff_name])
+        records = json.loads(output.decode("utf-8"))
+        self.assertEqual(len(records), 1)
+        tftf_length = os.path.getsize(self.tftf_name)
+        for header in records[0]["headers"]:
+            element = header["elements"][0]
+            self.assertEqual(element["length"], tftf_length)
+            self.assertEqual(element["tftf"]["length"], tftf_length)
+
+    def test_json_lines(self):
+        # Each record, including an error record, is a complete line
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(TOOLS_DIR, "display-ffff"),
+             "--jsonl", os.path.join(self.work_dir, "missing.ffff"),
+             self.ffff_name],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, _ = process.communicate()
+        output = output.decode("utf-8")
+        self.assertTrue(output.endswith("\n"))
+        records = [json.loads(line) for line in output.splitlines()]
+        self.assertEqual(len(records), 2)
+        self.assertIn("error", records[0])
+        self.assertEqual(records[1]["file"], self.ffff_name)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
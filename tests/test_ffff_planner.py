@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+
+from __future__ import print_function
+import os
+import sys
+import unittest
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+from ffff_planner import plan_element_layout, get_layout_slack
+
+ERASE_BLOCK_SIZE = 0x1000
+HEADER_END = 0x2000
+
+
+class PlanElementLayoutTest(unittest.TestCase):
+    def test_unpinned_in_order(self):
+        self.assertEqual(
+            plan_element_layout([(0, 0x1800, 0), (0, 0x800, 0)],
+                                ERASE_BLOCK_SIZE, HEADER_END),
+            [0x2000, 0x4000])
+
+    def test_pinned_kept(self):
+        self.assertEqual(
+            plan_element_layout([(0x8000, 0x1000, 0), (0x3000, 0x800, 0)],
+                                ERASE_BLOCK_SIZE, HEADER_END),
+            [0x8000, 0x3000])
+
+    def test_fills_gap_before_pin(self):
+        # The second element fits in the gap before the pinned one, but the
+        # first doesn't, so the given order yields to the shorter layout
+        self.assertEqual(
+            plan_element_layout([(0, 0x3000, 0), (0, 0x1000, 0),
+                                 (0x4000, 0x1000, 0)],
+                                ERASE_BLOCK_SIZE, HEADER_END),
+            [0x5000, 0x2000, 0x4000])
+
+    def test_element_alignment(self):
+        self.assertEqual(
+            plan_element_layout([(0, 0x800, 0x10000)],
+                                ERASE_BLOCK_SIZE, HEADER_END),
+            [0x10000])
+
+    def test_alignment_gap_reused(self):
+        # The elements are reordered to fill the space skipped to align the
+        # second one, which ends the layout at 0x43000 rather than 0x46000
+        self.assertEqual(
+            plan_element_layout([(0, 0x121f8, 0), (0, 0x12090, 0x10000),
+                                 (0, 0x12090, 0)],
+                                ERASE_BLOCK_SIZE, HEADER_END),
+            [0x2000, 0x30000, 0x15000])
+
+    def test_equal_end_keeps_order(self):
+        self.assertEqual(
+            plan_element_layout([(0, 0x1000, 0), (0, 0x1000, 0),
+                                 (0, 0x1000, 0)],
+                                ERASE_BLOCK_SIZE, HEADER_END),
+            [0x2000, 0x3000, 0x4000])
+
+    def test_does_not_fit(self):
+        self.assertRaises(ValueError, plan_element_layout,
+                          [(0, 0x2000, 0), (0x3000, 0x1000, 0)],
+                          ERASE_BLOCK_SIZE, HEADER_END, 0x5000)
+
+
+class GetLayoutSlackTest(unittest.TestCase):
+    def test_slack(self):
+        self.assertEqual(
+            get_layout_slack([(0x4000, 0x800), (0x2000, 0x1800)],
+                             ERASE_BLOCK_SIZE),
+            [0x800, 0x800])
+
+    def test_slack_to_image_end(self):
+        self.assertEqual(
+            get_layout_slack([(0x2000, 0x1800), (0x4000, 0x800)],
+                             ERASE_BLOCK_SIZE, 0x8000),
+            [0x800, 0x3800])
+
+
+if __name__ == "__main__":
+    unittest.main()
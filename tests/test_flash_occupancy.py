@@ -0,0 +1,95 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+from flash_occupancy import get_file_occupancy, OCCUPANCY_ELEMENT, \
+    OCCUPANCY_HEADER, OCCUPANCY_STRAY
+from ffff_image import make_ffff_image
+
+ERASE_BLOCK_SIZE = 0x1000
+ELEMENT_LOCATION = 0x4000
+
+
+class FileOccupancyTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        _, self.ffff_name = make_ffff_image(self.work_dir, ERASE_BLOCK_SIZE,
+                                            ELEMENT_LOCATION)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def get_runs(self, occupancy):
+        return dict((run["offset"], run) for run in occupancy["runs"]
+                    if run["occupancy"] in (OCCUPANCY_HEADER,
+                                            OCCUPANCY_ELEMENT,
+                                            OCCUPANCY_STRAY))
+
+    def test_intact_image(self):
+        runs = self.get_runs(get_file_occupancy(self.ffff_name))
+        self.assertEqual(sorted(runs), [0, ERASE_BLOCK_SIZE,
+                                        ELEMENT_LOCATION])
+        self.assertEqual(runs[0]["label"], "ffff[0]")
+        self.assertEqual(runs[ERASE_BLOCK_SIZE]["label"], "ffff[1]")
+        self.assertEqual(runs[ELEMENT_LOCATION]["occupancy"],
+                         OCCUPANCY_ELEMENT)
+
+    def test_damaged_first_header(self):
+        # With the first header's sentinel corrupted, the second header
+        # still accounts for itself and the elements, and only the damaged
+        # header's block is stray.
+        with open(self.ffff_name, "r+b") as wf:
+            wf.write(b"XXXX")
+        for erase_block_size in (None, ERASE_BLOCK_SIZE):
+            occupancy = get_file_occupancy(self.ffff_name, erase_block_size)
+            self.assertEqual(occupancy["erase_block_size"], ERASE_BLOCK_SIZE)
+            runs = self.get_runs(occupancy)
+            self.assertEqual(sorted(runs), [0, ERASE_BLOCK_SIZE,
+                                            ELEMENT_LOCATION])
+            self.assertEqual(runs[0]["occupancy"], OCCUPANCY_STRAY)
+            self.assertEqual(runs[ERASE_BLOCK_SIZE]["occupancy"],
+                             OCCUPANCY_HEADER)
+            self.assertEqual(runs[ERASE_BLOCK_SIZE]["label"], "ffff[1]")
+            self.assertEqual(runs[ELEMENT_LOCATION]["occupancy"],
+                             OCCUPANCY_ELEMENT)
+            self.assertEqual(occupancy["counts"][OCCUPANCY_STRAY], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
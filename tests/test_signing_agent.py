@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+
+from __future__ import print_function
+import os
+import sys
+import shutil
+import socket
+import hashlib
+import tempfile
+import threading
+import unittest
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+from crypto_backend import available_crypto_backends, get_crypto_backend
+from signing_agent import SigningAgentServer, SigningAgentClient, \
+    SigningAgentError
+
+KEY_NAME = "test@s2fsk.rsa2048-sha256"
+
+
+@unittest.skipUnless(available_crypto_backends(),
+                     "no crypto backend is installed")
+class SigningAgentTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # (Generating a key is slow, so share one across the tests)
+        cls.key = get_crypto_backend().generate_private_key(2048)
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.work_dir, "agent")
+        self.server = SigningAgentServer(self.socket_path,
+                                         {KEY_NAME: self.key})
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.client = SigningAgentClient(self.socket_path)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.work_dir)
+
+    def test_list_keys(self):
+        self.assertEqual(self.client.list_keys(),
+                         {KEY_NAME: self.key.public_key().fingerprint()})
+
+    def test_sign(self):
+        digest = hashlib.sha256(b"signable").digest()
+        signature = self.client.sign(KEY_NAME, digest, "sha256")
+        public_key = self.key.public_key()
+        self.assertTrue(public_key.verify(digest, signature, "sha256"))
+        self.assertFalse(public_key.verify(
+            hashlib.sha256(b"other").digest(), signature, "sha256"))
+
+    def test_unknown_key(self):
+        digest = hashlib.sha256(b"signable").digest()
+        with self.assertRaises(SigningAgentError) as context:
+            self.client.sign("other@s2fsk.rsa2048-sha256", digest, "sha256")
+        self.assertIn("No key named", str(context.exception))
+        # (The connection survives a refused request)
+        self.assertIn(KEY_NAME, self.client.list_keys())
+
+    def test_malformed_request(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            rfile = sock.makefile("rb")
+            sock.sendall(b"not json\n")
+            response = rfile.readline()
+            rfile.close()
+        finally:
+            sock.close()
+        self.assertTrue(response.startswith(b'{"error": '))
+
+
+if __name__ == "__main__":
+    unittest.main()
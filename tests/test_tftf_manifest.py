@@ -0,0 +1,82 @@
+#! /usr/bin/env python
+
+#
+# Copyright (c) 2015 Google Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name of the copyright holder nor the names of its
+# contributors may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+
+
+from __future__ import print_function
+import os
+import sys
+import unittest
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+from tftf import compare_tftf_manifests
+
+
+def make_manifest(header, sections):
+    # Build a manifest from a header digest and (type name, digest) tuples
+    return {"hash_algorithm": "sha256",
+            "header": header,
+            "sections": [{"type_name": type_name, "digest": digest}
+                         for type_name, digest in sections]}
+
+
+class CompareManifestsTest(unittest.TestCase):
+    def get_results(self, old, new):
+        return [(record.get("index"), record["result"])
+                for record in compare_tftf_manifests(old, new)]
+
+    def test_changes(self):
+        old = make_manifest("h1", [("code", "c1"), ("data", "d1"),
+                                   ("data", "d2")])
+        new = make_manifest("h2", [("code", "c1"), ("data", "d3")])
+        self.assertEqual(self.get_results(old, new),
+                         [(None, "changed"), (0, "same"), (1, "changed"),
+                          (2, "removed")])
+
+    def test_type_change_is_replaced(self):
+        old = make_manifest("h1", [("code", "c1"), ("data", "d1")])
+        new = make_manifest("h2", [("code", "c1"), ("signature", "s1"),
+                                   ("signature", "s2")])
+        records = compare_tftf_manifests(old, new)
+        self.assertEqual(records[2]["result"], "replaced")
+        self.assertEqual(records[2]["old_type_name"], "data")
+        self.assertEqual(records[2]["type_name"], "signature")
+        self.assertEqual(records[3]["result"], "added")
+
+    def test_hash_algorithm_mismatch(self):
+        old = make_manifest("h1", [])
+        new = make_manifest("h1", [])
+        new["hash_algorithm"] = "sha512"
+        self.assertRaises(ValueError, compare_tftf_manifests, old, new)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -30,12 +30,25 @@
 
 from __future__ import print_function
 import os
-from struct import pack_into, unpack_from
+import hashlib
+import json
+import mmap
+import threading
+import zlib
+from struct import pack_into, unpack_from, Struct
 from string import rfind
-from time import gmtime, strftime
-from util import display_binary_data, error
+from util import display_binary_data, error, buffer_view, buffer_slice, \
+    find_collisions, get_timestamp, header_string, parallel_map
 from signature_block import signature_block_write_map
 from signature_common import TFTF_SIGNATURE_ALGORITHM_RSA_2048_SHA_256
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        # LZMA compression is unavailable (Python 2 needs backports.lzma)
+        lzma = None
 
 # TFTF section types
 TFTF_SECTION_TYPE_RESERVED = 0x00
@@ -71,6 +84,28 @@ countable_tftf_types = \
      TFTF_SECTION_TYPE_MANIFEST,
      TFTF_SECTION_TYPE_CERTIFICATE)
 
+# Compressible types, and their compressed counterparts
+compressed_tftf_types = {
+    TFTF_SECTION_TYPE_RAW_CODE: TFTF_SECTION_TYPE_COMPRESSED_CODE,
+    TFTF_SECTION_TYPE_RAW_DATA: TFTF_SECTION_TYPE_COMPRESSED_DATA,
+}
+
+# Section compression codecs (see: compress_section).
+# NB. The TFTF header doesn't record which codec compressed a section, so
+# the codec must be the one expected by the loader for the boot stage.
+TFTF_COMPRESSION_ZLIB = "zlib"
+TFTF_COMPRESSION_LZMA = "lzma"
+tftf_compression_codecs = (TFTF_COMPRESSION_ZLIB, TFTF_COMPRESSION_LZMA)
+
+# Largest piece of the signable blob to copy at a time (see:
+# get_signable_chunks)
+TFTF_SIGNABLE_CHUNK_SIZE = 1024 * 1024
+
+# Per-section digest manifests (see: Tftf.get_section_digests). The manifest
+# for "foo.tftf" is kept alongside it in "foo.tftf.digests".
+TFTF_MANIFEST_EXTENSION = ".digests"
+TFTF_MANIFEST_HASH_ALGORITHM = "sha256"
+
 
 # Other TFTF header constants (mostly field sizes)
 TFTF_HEADER_SIZE_MIN = 512
@@ -138,6 +173,13 @@ TFTF_HDR_LEN_RESERVED = \
      (TFTF_HDR_LEN_FIXED_PART + TFTF_HDR_LEN_SECTION_TABLE))
 TFTF_HDR_NUM_RESERVED = (TFTF_HDR_LEN_RESERVED / TFTF_RSVD_SIZE)
 
+# Precompiled TFTF section descriptor format. This (and the header formats
+# in TftfLayout) is used to decode straight out of the loaded buffer (see:
+# buffer_view) instead of re-parsing a format string and copying the
+# buffer for each field.
+TFTF_SECTION_STRUCT = Struct("<LLLLL")
+TFTF_HEADER_SIZE_STRUCT = Struct("<L")
+
 # TFTF header field offsets
 TFTF_HDR_OFF_SENTINEL = 0
 TFTF_HDR_OFF_HEADER_SIZE = (TFTF_HDR_OFF_SENTINEL +
@@ -200,10 +242,24 @@ TFTF_FILE_EXTENSION = ".bin"
 TFTF_VALID = 0
 TFTF_INVALID = 1
 TFTF_VALID_WITH_COLLISIONS = 2
+tftf_validity_names = {
+    TFTF_VALID: "valid",
+    TFTF_INVALID: "invalid",
+    TFTF_VALID_WITH_COLLISIONS: "valid_with_collisions",
+}
 
 # Size of the blob to copy each time
 copy_blob_size = 1024*1024*10
 
+# Cache of TFTF header layouts, indexed by header size (see: get_tftf_layout)
+tftf_layouts = {}
+tftf_layouts_lock = threading.Lock()
+
+# Process-wide cache of loaded TFTF files (see: load_tftf), indexed by
+# pathname. Each entry is a (stat signature, Tftf) tuple.
+tftf_cache = {}
+tftf_cache_lock = threading.Lock()
+
 section_type_names = {
     TFTF_SECTION_TYPE_RESERVED: "Reserved",
     TFTF_SECTION_TYPE_RAW_CODE: "Code",
@@ -229,6 +285,69 @@ section_type_short_names = {
 }
 
 
+class TftfLayout(object):
+    """Field layout of a TFTF header of a given size
+
+    Because we have variable-size TFTF headers, the number of entries in the
+    section table, and the offsets to all fields which follow, depend on the
+    header size. A TftfLayout captures these for one header size, along with
+    the precompiled header formats.
+
+    Layouts are immutable, so they can be shared between TFTFs (and
+    threads). Use get_tftf_layout() rather than creating them directly.
+    """
+    def __init__(self, header_size):
+        """Constructor"""
+        # TFTF section table and derived lengths
+        num_sections = \
+            ((header_size -
+             (TFTF_HDR_LEN_FIXED_PART + TFTF_HDR_LEN_MIN_RESERVED)) //
+             TFTF_SECTION_LEN)
+        len_section_table = num_sections * TFTF_SECTION_LEN
+
+        # (The reserved array is made up of what's left over after creating
+        # the section array.)
+        len_reserved = header_size - \
+            (TFTF_HDR_LEN_FIXED_PART + len_section_table)
+        num_reserved = len_reserved // TFTF_RSVD_SIZE
+
+        fields = {
+            "header_size": header_size,
+            "num_sections": num_sections,
+            "len_section_table": len_section_table,
+            "len_reserved": len_reserved,
+            "num_reserved": num_reserved,
+            "off_reserved": TFTF_HDR_OFF_RESERVED,
+            # Offsets to fields following the first variable-length table
+            # (Reserved)
+            "off_sections": TFTF_HDR_OFF_RESERVED + len_reserved,
+            # The fixed part of the header plus the reserved array
+            "header_struct": Struct("<4sL16s48sLLLLLL" + "L" * num_reserved),
+            "reserved_struct": Struct("<" + "L" * num_reserved),
+            "section_struct": TFTF_SECTION_STRUCT,
+        }
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TftfLayout is immutable")
+
+
+def get_tftf_layout(header_size):
+    """Return the (shared) TftfLayout for a TFTF header size
+
+    Each layout is computed only once per header size.
+    """
+    layout = tftf_layouts.get(header_size)
+    if not layout:
+        with tftf_layouts_lock:
+            layout = tftf_layouts.get(header_size)
+            if not layout:
+                layout = TftfLayout(header_size)
+                tftf_layouts[header_size] = layout
+    return layout
+
+
 class TftfSection:
     """TFTF Section representation"""
     def __init__(self, section_type, section_class=0, section_id=0,
@@ -255,10 +374,9 @@ class TftfSection:
         if filename:
             try:
                 statinfo = os.stat(filename)
-                # TODO: Lengths will be different if/when we support
-                # compression:
-                # - section_length will shrink to the compressed size
-                # - expanded_length will remain the input file length
+                # (Sections sized from files are uncompressed; compressed
+                # sections are added from their compressed data, with the
+                # original length as the expanded_length.)
                 self.section_length = statinfo.st_size
                 self.expanded_length = statinfo.st_size
             except:
@@ -267,7 +385,11 @@ class TftfSection:
     def unpack(self, section_buf, section_offset):
         # Unpack a section header from a TFTF header buffer, and return
         # a flag indicating if the section was a section-end
-        section_hdr = unpack_from("<LLLLL", str(section_buf), section_offset)
+        #
+        # section_buf is typically a memoryview over the whole TFTF buffer,
+        # so this decodes in place without copying the buffer.
+        section_hdr = TFTF_SECTION_STRUCT.unpack_from(section_buf,
+                                                      section_offset)
         type_class = section_hdr[0]
         self.section_type = type_class & 0x000000ff
         self.section_class = (type_class >> 8) & 0x00ffffff
@@ -281,12 +403,12 @@ class TftfSection:
         # Pack a section header into a TFTF header buffer at the specified
         # offset, returning the offset of the next section.
         type_class = (self.section_class << 8) | self.section_type
-        pack_into("<LLLLL", buf, offset,
-                  type_class,
-                  self.section_id,
-                  self.section_length,
-                  self.load_address,
-                  self.expanded_length)
+        TFTF_SECTION_STRUCT.pack_into(buf, offset,
+                                      type_class,
+                                      self.section_id,
+                                      self.section_length,
+                                      self.load_address,
+                                      self.expanded_length)
         return offset + TFTF_SECTION_LEN
 
     def section_name(self, section_type):
@@ -304,6 +426,16 @@ class TftfSection:
         else:
             return "?"
 
+    def to_dict(self):
+        """Return the section header fields as a dictionary"""
+        return {"type": self.section_type,
+                "type_name": self.section_short_name(self.section_type),
+                "class": self.section_class,
+                "id": self.section_id,
+                "length": self.section_length,
+                "load_address": self.load_address,
+                "expanded_length": self.expanded_length}
+
     def display_table_header(self, indent):
         # Print the section table column names, returning the column
         # header for the section table (no indentation)
@@ -362,7 +494,7 @@ class TftfSection:
 
 class Tftf:
     """TFTF representation"""
-    def __init__(self, header_size, filename=None):
+    def __init__(self, header_size, filename=None, use_mmap=False):
         """ TFTF constructor
 
         Basically, there are 2 logical constructor forms:
@@ -372,6 +504,9 @@ class Tftf:
         following forms:
             - Tftf(header_size, None) # create a blank TFTF
             - Tftf(0, filename)       # read an existing TFTF
+
+        If use_mmap is True, an existing TFTF file is memory-mapped
+        read-only instead of being read into memory (see: load_tftf_file).
         """
         # Size the buffer: if we're creating a blank TFTF use the supplied
         # header_size. If we're loading it from a file, (header_size = 0 and
@@ -404,13 +539,17 @@ class Tftf:
         self.unipro_pid = 0
         self.ara_vid = 0
         self.ara_pid = 0
-        self.reserved = [0] * TFTF_HDR_NUM_RESERVED
+        if header_size == 0:
+            self.layout = get_tftf_layout(TFTF_HEADER_SIZE_DEFAULT)
+        else:
+            self.layout = get_tftf_layout(header_size)
+        self.reserved = [0] * self.layout.num_reserved
         self.sections = []
 
         if filename:
             # Load the TFTF buffer and parse it for the TFTF header and
             # section list
-            self.load_tftf_file(filename)
+            self.load_tftf_file(filename, use_mmap)
         else:
             # Salt the list with the end-of-table, because we will be
             # adding sections manually later
@@ -429,33 +568,19 @@ class Tftf:
 
         Because we have variable-size TFTF headers, we need to recalculate the
         number of entries in the section table, and the offsets to all fields
-        which follow.
+        which follow. These are held in this TFTF's layout (see: TftfLayout)
+        rather than in module globals, so TFTFs with different header sizes
+        can coexist.
         """
-        global TFTF_HDR_NUM_SECTIONS, TFTF_HDR_LEN_SECTION_TABLE, \
-            TFTF_HDR_LEN_RESERVED, TFTF_HDR_OFF_RESERVED, \
-            TFTF_HDR_OFF_SECTIONS, TFTF_HDR_NUM_RESERVED
-        # TFTF section table and derived lengths
-        TFTF_HDR_NUM_SECTIONS = \
-            ((self.header_size -
-             (TFTF_HDR_LEN_FIXED_PART + TFTF_HDR_LEN_MIN_RESERVED)) //
-             TFTF_SECTION_LEN)
-        TFTF_HDR_LEN_SECTION_TABLE = (TFTF_HDR_NUM_SECTIONS * TFTF_SECTION_LEN)
-
-        # (The reserved array is made up of what's left over after creating the
-        # section array.)
-        TFTF_HDR_LEN_RESERVED = \
-            self.header_size - \
-            (TFTF_HDR_LEN_FIXED_PART + TFTF_HDR_LEN_SECTION_TABLE)
-        TFTF_HDR_NUM_RESERVED = TFTF_HDR_LEN_RESERVED / TFTF_RSVD_SIZE
+        self.layout = get_tftf_layout(self.header_size)
 
         # DO NOT CLEAR RESERVED - IT IS USED FOR TFTF VERSION
         #self.reserved = [0] * TFTF_HDR_NUM_RESERVED
-        # Offsets to fields following the first variable-length table
-        # (Reserved)
-        TFTF_HDR_OFF_SECTIONS = (TFTF_HDR_OFF_RESERVED +
-                                 TFTF_HDR_LEN_RESERVED)
+        # (Just resize it, keeping any existing values.)
+        num_reserved = self.layout.num_reserved
+        self.reserved = (self.reserved + [0] * num_reserved)[:num_reserved]
 
-    def load_tftf_file(self, filename):
+    def load_tftf_file(self, filename, use_mmap=False):
         """Try to import a TFTF header and/or file
 
         If "buf" is None, then we only import the TFTF header.  However, if
@@ -463,6 +588,13 @@ class Tftf:
         entire TFTF file is also imported into the buffer.  This is to allow
         for cases where the caller needs to determine the TFTF characteristics
         before creating their buffer.
+
+        If use_mmap is True, tftf_buf becomes a read-only mapping of the file
+        rather than a copy of it, so only the pages actually touched (e.g.,
+        the header) are read. The section payloads are paged in on demand by
+        display_data, get_section_data_up_to_section, etc., and the mapping
+        is replaced by an in-memory copy the first time something needs to
+        modify the buffer (see: make_writable).
         """
         success = True
         if filename:
@@ -475,8 +607,10 @@ class Tftf:
                     rf = open(name, 'rb')
                     break
                 except:
-                    print("can't find TFTF file"), filename
-                    success = False
+                    pass
+            if not rf:
+                error("can't find TFTF file", filename)
+                success = False
 
             if success:
                 # Record the length of the entire TFTF blob (this will be
@@ -485,10 +619,16 @@ class Tftf:
                 self.tftf_length = rf.tell()
 
                 rf.seek(0, 0)
-                # (Display-tftf case) Read the entire TFTF file into
-                # a local buffer
-                self.tftf_buf = bytearray(self.tftf_length)
-                rf.readinto(self.tftf_buf)
+                if use_mmap and self.tftf_length > 0:
+                    # Map the file (the map holds its own reference to the
+                    # file, so we can close ours)
+                    self.tftf_buf = mmap.mmap(rf.fileno(), 0,
+                                              access=mmap.ACCESS_READ)
+                else:
+                    # (Display-tftf case) Read the entire TFTF file into
+                    # a local buffer
+                    self.tftf_buf = bytearray(self.tftf_length)
+                    rf.readinto(self.tftf_buf)
                 rf.close()
                 self.unpack()
                 self.post_process()
@@ -497,14 +637,46 @@ class Tftf:
     def load_tftf_from_buffer(self, buf):
         """Import a TFTF blob from a memory buffer"""
         self.tftf_buf = buf
+        self.tftf_length = len(buf)
         self.unpack()
 
+    def is_mapped(self):
+        """Determine if the TFTF buffer is a read-only file mapping"""
+        return isinstance(self.tftf_buf, mmap.mmap)
+
+    def make_writable(self):
+        """Ensure that the TFTF buffer can be modified
+
+        If the TFTF buffer is a read-only file mapping, replace it with an
+        in-memory copy (reading the whole file) and release the mapping.
+        """
+        if self.is_mapped():
+            mapping = self.tftf_buf
+            self.tftf_buf = bytearray(mapping)
+            mapping.close()
+
     def unpack(self):
         # Unpack a TFTF header from a buffer
-        fmt_string = "<4sL16s48sLLLLLL" + "L" * TFTF_HDR_NUM_RESERVED
-        tftf_hdr = unpack_from(fmt_string, str(self.tftf_buf))
+        #
+        # All fields are decoded in place from a single view of the buffer,
+        # so the cost is independent of the size of the section payloads.
+        view = buffer_view(self.tftf_buf)
+        self.header_size = TFTF_HEADER_SIZE_STRUCT.unpack_from(
+            view, TFTF_HDR_OFF_HEADER_SIZE)[0]
+
+        # Since the imported header_size may be different from our 512-byte
+        # default, we need to switch to the layout for that size before
+        # unpacking the reserved and section tables. (A nonsensical size,
+        # e.g. from an erased block, is parsed with the default layout.)
+        if (self.header_size < TFTF_HEADER_SIZE_MIN) or \
+           (self.header_size > TFTF_HEADER_SIZE_MAX):
+            self.layout = get_tftf_layout(TFTF_HEADER_SIZE_DEFAULT)
+        else:
+            self.recalculate_header_offsets()
+        layout = self.layout
+
+        tftf_hdr = layout.header_struct.unpack_from(view, 0)
         self.sentinel = tftf_hdr[0]
-        self.header_size = tftf_hdr[1]
         self.timestamp = tftf_hdr[2]
         self.firmware_package_name = tftf_hdr[3]
         self.package_type = tftf_hdr[4]
@@ -513,24 +685,17 @@ class Tftf:
         self.unipro_pid = tftf_hdr[7]
         self.ara_vid = tftf_hdr[8]
         self.ara_pid = tftf_hdr[9]
-
-        # Since the imported header_size may be different from our 512-byte
-        # default, we need to recalculate the size of the reserved and
-        # section tables and their offsets
-        self.recalculate_header_offsets()
-
-        for i in range(TFTF_HDR_NUM_RESERVED):
-            self.reserved[i] = tftf_hdr[10+i]
+        self.reserved = list(tftf_hdr[10:])
 
         # Purge (the EOT from) the list because we're populating the entire
         # list from the file
         self.sections = []
 
         # Parse the table of section headers
-        section_offset = TFTF_HDR_OFF_SECTIONS
-        for section_index in range(TFTF_HDR_NUM_SECTIONS):
+        section_offset = layout.off_sections
+        for section_index in range(layout.num_sections):
             section = TftfSection(0)
-            if section.unpack(self.tftf_buf, section_offset):
+            if section.unpack(view, section_offset):
                 self.sections.append(section)
                 section_offset += TFTF_SECTION_LEN
 
@@ -547,47 +712,62 @@ class Tftf:
     def pack(self):
         # Pack the TFTF header members into the TFTF header buffer, prior
         # to writing the buffer out to a file.
+        if self.is_mapped():
+            # Pack into a scratch copy of the mapped header and only give up
+            # the mapping if that actually changed something.
+            header = bytearray(self.tftf_buf[0:self.header_size])
+            self.pack_header(header)
+            if header == self.tftf_buf[0:self.header_size]:
+                return
+            self.make_writable()
+        self.pack_header(self.tftf_buf)
+
+    def pack_header(self, buf):
+        # Pack the TFTF header members into the start of buf
 
         # Populate the fixed part of the TFTF header.
         # (Note that we need to break up the packing because the "s" format
         # doesn't zero-pad a string shorter than the field width)
-        pack_into("<4sL16s", self.tftf_buf, 0,
+        pack_into("<4sL16s", buf, 0,
                   self.sentinel,
                   self.header_size,
                   self.timestamp)
         if self.firmware_package_name:
-            pack_into("<48s", self.tftf_buf, TFTF_HDR_OFF_NAME,
+            pack_into("<48s", buf, TFTF_HDR_OFF_NAME,
                       self.firmware_package_name)
-        pack_into("<LLLLLL", self.tftf_buf, TFTF_HDR_OFF_PACKAGE_TYPE,
+        pack_into("<LLLLLL", buf, TFTF_HDR_OFF_PACKAGE_TYPE,
                   self.package_type,
                   self.start_location,
                   self.unipro_mfg_id,
                   self.unipro_pid,
                   self.ara_vid,
                   self.ara_pid)
-        for i in range(TFTF_HDR_NUM_RESERVED):
-            pack_into("<L", self.tftf_buf,
-                      TFTF_HDR_OFF_RESERVED + (TFTF_RSVD_SIZE * i),
-                      self.reserved[i])
+        self.layout.reserved_struct.pack_into(buf, self.layout.off_reserved,
+                                              *self.reserved)
 
         # Pack the section headers into the TFTF header buffer
-        offset = TFTF_HDR_OFF_SECTIONS
+        offset = self.layout.off_sections
         for section in self.sections:
-            offset = section.pack(self.tftf_buf, offset)
+            offset = section.pack(buf, offset)
 
     def add_section(self, section_type, section_class, section_id,
-                    section_data, load_address=0):
+                    section_data, load_address=0, expanded_length=None):
         # Add a new section to the section table and return a success flag
         #
         # (This would be called by "sign-tftf" to add signature and
         # certificate blocks.)
+        #
+        # For compressed sections, section_data is the compressed data
+        # and expanded_length is the length once decompressed.
+        if expanded_length is None:
+            expanded_length = len(section_data)
         num_sections = len(self.sections)
-        if num_sections < TFTF_HDR_NUM_SECTIONS:
+        if num_sections < self.layout.num_sections:
             # Insert the section to the section list, just in front of
             # the end-of-table marker.
             #
             # Notes:
-            #   1. We assume this is an uncompressable section
+            #   1. Any compression has already been applied to section_data
             #   2. We defer pushing the new section into the buffer until
             #      the write stage or someone explicitly calls "pack".)
             self.sections.insert(num_sections - 1,
@@ -596,10 +776,11 @@ class Tftf:
                                              section_id,
                                              len(section_data),
                                              load_address,
-                                             len(section_data),
+                                             expanded_length,
                                              None))
 
             # Append the section data blob to our TFTF buffer
+            self.make_writable()
             self.tftf_buf += section_data
 
             # Record the length of the entire TFTF blob (this will be longer
@@ -611,19 +792,47 @@ class Tftf:
             return False
 
     def add_section_from_file(self, section_type, section_class, section_id,
-                              filename, load_address=0):
+                              filename, load_address=0, offset=0,
+                              length=None, expanded_length=None):
         # Add a new section from a file and return a success flag
         #
         # (This would be called by "create-tftf" while/after parsing section
         # parameters)
-        if len(self.sections) < TFTF_HDR_NUM_SECTIONS:
+        #
+        # If length is specified, the section is the length bytes at offset
+        # in the file (e.g., an ELF segment), which are copied straight from
+        # a mapping of the file into the TFTF buffer.
+        if len(self.sections) < self.layout.num_sections:
             try:
                 with open(filename, 'rb') as readfile:
-                    section_data = readfile.read()
-
-                return self.add_section(section_type, section_class,
-                                        section_id, section_data,
-                                        load_address)
+                    if length is None:
+                        readfile.seek(offset)
+                        section_data = readfile.read()
+                        return self.add_section(section_type, section_class,
+                                                section_id, section_data,
+                                                load_address,
+                                                expanded_length)
+
+                    if length == 0:
+                        return self.add_section(section_type, section_class,
+                                                section_id, b"",
+                                                load_address,
+                                                expanded_length)
+                    mapping = mmap.mmap(readfile.fileno(), 0,
+                                        access=mmap.ACCESS_READ)
+                    try:
+                        section_data = buffer_slice(mapping, offset, length)
+                        if len(section_data) != length:
+                            raise ValueError("section extends past EOF")
+                        success = self.add_section(section_type,
+                                                   section_class, section_id,
+                                                   section_data, load_address,
+                                                   expanded_length)
+                        # (Release the slice so that the mapping can close)
+                        section_data = None
+                        return success
+                    finally:
+                        mapping.close()
             except:
                 error("Unable to read", filename)
                 return False
@@ -636,33 +845,17 @@ class Tftf:
         #
         # This would be called by "create-ffff" after parsing all of the
         # parameters and calling update_ffff_sections().
-
-        for comp_a, section_a in enumerate(self.sections):
-            collision = []
-            # extract sections[comp_a]
-            if section_a.section_type == TFTF_SECTION_TYPE_SIGNATURE or \
-               section_a.section_type == TFTF_SECTION_TYPE_END_OF_DESCRIPTORS:
+        extents = []
+        for section in self.sections:
+            if section.section_type == TFTF_SECTION_TYPE_SIGNATURE or \
+               section.section_type == TFTF_SECTION_TYPE_END_OF_DESCRIPTORS:
                 break
+            extents.append((section.load_address,
+                            section.load_address +
+                            section.expanded_length - 1))
 
-            start_a = section_a.load_address
-            end_a = start_a + section_a.expanded_length - 1
-            for comp_b, section_b in enumerate(self.sections):
-                # skip checking one's self
-                if comp_a != comp_b:
-                    # extract sections[comp_b]
-                    if section_b.section_type == \
-                       TFTF_SECTION_TYPE_SIGNATURE or \
-                       section_b.section_type == \
-                       TFTF_SECTION_TYPE_END_OF_DESCRIPTORS:
-                        break
-
-                    start_b = section_b.load_address
-                    end_b = start_b + section_b.expanded_length - 1
-                    if end_b >= start_a and \
-                       start_b <= end_a:
-                        self.collisions_found = True
-                        collision += [comp_b]
-            self.collisions += [collision]
+        self.collisions = find_collisions(extents)
+        self.collisions_found = any(self.collisions)
         return self.collisions_found
 
     def sniff_test(self):
@@ -694,11 +887,9 @@ class Tftf:
         """
         self.sentinel == TFTF_SENTINEL
 
-        # Check for collisions
         self.sentinel = TFTF_SENTINEL
-        self.check_for_collisions()
         if self.timestamp == "":
-            self.timestamp = strftime("%Y%m%d %H%M%S", gmtime())
+            self.timestamp = get_timestamp()
 
         # Trim the name to length
         if self.firmware_package_name:
@@ -800,16 +991,48 @@ class Tftf:
                 print(section_string)
 
         # Note any unused sections
-        num_unused_sections = TFTF_HDR_NUM_SECTIONS - len(self.sections)
+        num_unused_sections = self.layout.num_sections - len(self.sections)
         if num_unused_sections > 1:
             print("{0:s}  {1:2d} (unused)".format(indent, len(self.sections)))
         if num_unused_sections > 2:
             print("{0:s}   :    :".format(indent))
         if num_unused_sections > 0:
             print("{0:s}  {1:2d} (unused)".
-                  format(indent, TFTF_HDR_NUM_SECTIONS-1))
+                  format(indent, self.layout.num_sections - 1))
         print(" ")
 
+    def to_dict(self):
+        """Return the TFTF header fields as a dictionary
+
+        This is the machine-readable counterpart of display(), for JSON
+        output. Only the header is used, so a mapped TFTF's section payloads
+        are never read.
+        """
+        sections = []
+        for index, section in enumerate(self.sections):
+            if section.section_type == TFTF_SECTION_TYPE_END_OF_DESCRIPTORS:
+                break
+            section_dict = section.to_dict()
+            if index < len(self.collisions):
+                section_dict["collisions"] = self.collisions[index]
+            sections.append(section_dict)
+        return {"sentinel": header_string(self.sentinel),
+                "header_size": self.header_size,
+                "timestamp": header_string(self.timestamp),
+                "firmware_package_name":
+                    header_string(self.firmware_package_name),
+                "package_type": self.package_type,
+                "start_location": self.start_location,
+                "unipro_mfg_id": self.unipro_mfg_id,
+                "unipro_pid": self.unipro_pid,
+                "ara_vid": self.ara_vid,
+                "ara_pid": self.ara_pid,
+                "reserved": list(self.reserved),
+                "length": self.tftf_length,
+                "validity": tftf_validity_names.get(self.header_validity,
+                                                    "invalid"),
+                "sections": sections}
+
     def display_data(self, title=None, indent=""):
         """Display the payload referenced by a single TFTF header"""
         # 1. Print the title line
@@ -860,7 +1083,7 @@ class Tftf:
 
         # Flush any changes out to the buffer and return the substring
         self.pack()
-        slice_end = TFTF_HDR_OFF_SECTIONS + \
+        slice_end = self.layout.off_sections + \
             section_index * TFTF_SECTION_LEN
         return self.tftf_buf[0:slice_end]
 
@@ -885,6 +1108,105 @@ class Tftf:
             slice_end += section.section_length
         return self.tftf_buf[self.header_size:slice_end]
 
+    def get_signable_chunks(self, section_index,
+                            chunk_size=TFTF_SIGNABLE_CHUNK_SIZE, flush=True):
+        """Generate the blob to be signed, in pieces
+
+        Yields the same bytes as get_header_up_to_section followed by
+        get_section_data_up_to_section, but as a series of (binary) strings
+        of at most chunk_size bytes, sliced in turn from zero-copy views of
+        the header and of each section. This allows the blob to be fed to an
+        incremental digest without ever assembling it in memory.
+
+        If flush is False, the buffer is used as it stands rather than being
+        repacked first (e.g., to verify a signature over the stored bytes).
+        """
+        if section_index > len(self.sections):
+            return
+
+        # Flush any changes out to the buffer
+        if flush:
+            self.pack()
+        extents = [(0, self.layout.off_sections +
+                    section_index * TFTF_SECTION_LEN)]
+        offset = self.header_size
+        for section in self.sections[:section_index]:
+            extents.append((offset, section.section_length))
+            offset += section.section_length
+
+        for start, length in extents:
+            for chunk in self.get_extent_chunks(start, length, chunk_size):
+                yield chunk
+
+    def get_extent_chunks(self, start, length,
+                          chunk_size=TFTF_SIGNABLE_CHUNK_SIZE):
+        # Generate a range of the TFTF buffer as a series of (binary)
+        # strings of at most chunk_size bytes (see: get_signable_chunks)
+        for chunk_start in range(start, start + length, chunk_size):
+            chunk = buffer_slice(self.tftf_buf, chunk_start,
+                                 min(chunk_size,
+                                     start + length - chunk_start))
+            if isinstance(chunk, memoryview):
+                yield chunk.tobytes()
+            else:
+                yield bytes(chunk)
+
+    def get_section_digests(self, hash_algorithm=TFTF_MANIFEST_HASH_ALGORITHM,
+                            flush=True):
+        """Return a manifest of per-section digests
+
+        The manifest is a JSON-able dictionary with a (hex) digest of the
+        header and of each section's data, so that two TFTFs (or a TFTF and
+        an earlier manifest of it) can be compared section by section (see:
+        compare_tftf_manifests) without holding on to, or re-reading, the
+        unchanged one.
+
+        If flush is False, the buffer is digested as it stands rather than
+        being repacked first.
+        """
+        if flush:
+            self.pack()
+        manifest = {"hash_algorithm": hash_algorithm,
+                    "header_size": self.header_size,
+                    "header": self.get_extent_digest(0, self.header_size,
+                                                     hash_algorithm),
+                    "sections": []}
+        offset = self.header_size
+        for index, section in enumerate(self.sections):
+            if section.section_type == TFTF_SECTION_TYPE_END_OF_DESCRIPTORS:
+                break
+            manifest["sections"].append({
+                "index": index,
+                "type_name": section.section_short_name(section.section_type),
+                "length": section.section_length,
+                "digest": self.get_extent_digest(offset,
+                                                 section.section_length,
+                                                 hash_algorithm)})
+            offset += section.section_length
+        return manifest
+
+    def get_extent_digest(self, start, length, hash_algorithm):
+        # Return the (hex) digest of a range of the TFTF buffer
+        digest = hashlib.new(hash_algorithm)
+        for chunk in self.get_extent_chunks(start, length):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def write_manifest(self, tftf_filename, flush=True):
+        """Write the per-section digest manifest for a TFTF file
+
+        The manifest (see: get_section_digests) is written alongside the
+        TFTF file, with TFTF_MANIFEST_EXTENSION appended to its name.
+        Returns the manifest's filename.
+        """
+        manifest_filename = tftf_filename + TFTF_MANIFEST_EXTENSION
+        manifest = self.get_section_digests(flush=flush)
+        with open(manifest_filename, 'w') as wf:
+            json.dump(manifest, wf, sort_keys=True, indent=2,
+                      separators=(",", ": "))
+            wf.write("\n")
+        return manifest_filename
+
     def create_map_file(self, base_name, base_offset, prefix=""):
         """Create a map file from the base name
 
@@ -933,12 +1255,12 @@ class Tftf:
         for i in range(len(self.reserved)):
             wf.write("{0:s}reserved[{1:d}]  {2:08x}\n".
                      format(prefix, i,
-                            base_offset + TFTF_HDR_OFF_RESERVED +
+                            base_offset + self.layout.off_reserved +
                             (TFTF_RSVD_SIZE * i)))
 
         # Dump the section descriptors (used and free)
-        section_offset = base_offset + TFTF_HDR_OFF_SECTIONS
-        for index in range(TFTF_HDR_NUM_SECTIONS):
+        section_offset = base_offset + self.layout.off_sections
+        for index in range(self.layout.num_sections):
             wf.write("{0:s}section[{1:d}].type  {2:08x}\n".
                      format(prefix, index,
                             section_offset + TFTF_SECTION_OFF_TYPE))
@@ -974,3 +1296,136 @@ class Tftf:
             # Otherwise, just describe it generically
                 wf.write("{0:s}  {1:08x}\n".format(sn_name, base_offset))
             base_offset += section.section_length
+
+
+def compression_available(codec):
+    """Determine if a section compression codec can be used here"""
+    if codec == TFTF_COMPRESSION_LZMA:
+        return lzma is not None
+    return codec in tftf_compression_codecs
+
+
+def compress_section(section_data, codec):
+    """Compress a section's data with the named codec
+
+    zlib produces a zlib (RFC 1950) deflate stream; lzma produces a
+    "legacy" .lzma (LZMA_Alone) stream, which carries the expanded size
+    and is the form most small decoders accept.
+    """
+    if codec == TFTF_COMPRESSION_ZLIB:
+        return zlib.compress(bytes(section_data), 9)
+    elif codec == TFTF_COMPRESSION_LZMA and lzma:
+        return lzma.compress(bytes(section_data),
+                             format=lzma.FORMAT_ALONE, preset=9)
+    raise ValueError("Compression codec '{0:s}' is unavailable".
+                     format(codec))
+
+
+def compress_section_job(job):
+    # multiprocessing worker for compress_sections
+    return compress_section(*job)
+
+
+def compress_sections(blobs, codec, jobs=None):
+    """Compress a list of section data blobs in parallel
+
+    Returns the compressed blobs, in the same order. The blobs are
+    compressed by a pool of jobs processes (default: one per CPU), since
+    compression, rather than I/O, dominates building large payloads.
+    """
+    work = [(blob, codec) for blob in blobs]
+    return list(parallel_map(compress_section_job, work, jobs))
+
+
+def load_tftf(filename):
+    """Load a TFTF file through the process-wide TFTF cache
+
+    Returns the parsed Tftf for filename (trying the default extension if
+    needed), or None if the file can't be found. The file is read and
+    parsed only the first time it is asked for; subsequent calls return
+    the same Tftf object until the file's mtime, size or inode changes.
+
+    The returned Tftf is shared by all callers, so it must be treated as
+    read-only. Callers that want to modify a TFTF should create their own
+    with Tftf(0, filename).
+    """
+    statinfo = None
+    for name in (filename, filename + TFTF_FILE_EXTENSION):
+        try:
+            statinfo = os.stat(name)
+            break
+        except OSError:
+            pass
+    if not statinfo:
+        error("can't find TFTF file", filename)
+        return None
+
+    pathname = os.path.realpath(name)
+    signature = (statinfo.st_mtime, statinfo.st_size, statinfo.st_ino)
+    with tftf_cache_lock:
+        entry = tftf_cache.get(pathname)
+        if entry and entry[0] == signature:
+            return entry[1]
+        tftf = Tftf(0, name)
+        tftf_cache[pathname] = (signature, tftf)
+        return tftf
+
+
+def flush_tftf_cache():
+    """Discard all TFTFs held in the TFTF cache"""
+    with tftf_cache_lock:
+        tftf_cache.clear()
+
+
+def read_tftf_manifest(filename):
+    """Read a per-section digest manifest (see: Tftf.write_manifest)
+
+    Raises IOError if it can't be read, and ValueError if it's malformed.
+    """
+    with open(filename, 'r') as rf:
+        manifest = json.load(rf)
+    if not isinstance(manifest, dict) or \
+       not all(key in manifest for key in ("hash_algorithm", "header",
+                                           "sections")):
+        raise ValueError("{0:s} is not a TFTF manifest".format(filename))
+    return manifest
+
+
+def compare_tftf_manifests(old, new):
+    """Compare two per-section digest manifests
+
+    Returns a list of JSON-able records, one for the header and one for
+    each section in either manifest, each with a "result" of "same",
+    "changed", "replaced" (by a section of another type, whose old type is
+    given as "old_type_name"), "added" or "removed". Raises ValueError if
+    the manifests use different hash algorithms.
+    """
+    if old["hash_algorithm"] != new["hash_algorithm"]:
+        raise ValueError("Can't compare {0:s} and {1:s} digests".
+                         format(old["hash_algorithm"],
+                                new["hash_algorithm"]))
+    records = [{"part": "header",
+                "result": "same" if old["header"] == new["header"]
+                else "changed"}]
+    old_sections = old["sections"]
+    new_sections = new["sections"]
+    for index in range(max(len(old_sections), len(new_sections))):
+        record = {"part": "section", "index": index}
+        if index >= len(new_sections):
+            record["type_name"] = old_sections[index]["type_name"]
+            record["result"] = "removed"
+        elif index >= len(old_sections):
+            record["type_name"] = new_sections[index]["type_name"]
+            record["result"] = "added"
+        else:
+            record["type_name"] = new_sections[index]["type_name"]
+            if old_sections[index]["type_name"] != record["type_name"]:
+                record["old_type_name"] = old_sections[index]["type_name"]
+                record["result"] = "replaced"
+            elif old_sections[index]["digest"] == \
+                    new_sections[index]["digest"]:
+                record["result"] = "same"
+            else:
+                record["result"] = "changed"
+        records.append(record)
+    return records
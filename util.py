@@ -29,8 +29,13 @@
 #
 
 from __future__ import print_function
+import os
 import sys
 import binascii
+import heapq
+import json
+from struct import pack
+from time import gmtime, strftime
 
 # Program return values
 PROGRAM_SUCCESS = 0
@@ -53,6 +58,25 @@ def print_to_error(*objs):
     print(*objs, file=sys.stderr)
 
 
+def get_timestamp():
+    """Return the timestamp for a new TFTF or FFFF header
+
+    This is normally the current (UTC) time. For reproducible builds, it
+    is the time given by the SOURCE_DATE_EPOCH environment variable (see:
+    https://reproducible-builds.org/specs/source-date-epoch/), if set.
+    A malformed SOURCE_DATE_EPOCH is reported as an error, and exits.
+    """
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch:
+        try:
+            return strftime("%Y%m%d %H%M%S", gmtime(int(epoch)))
+        except (ValueError, OverflowError):
+            error("SOURCE_DATE_EPOCH must be an integer number of seconds "
+                  "(not '" + epoch + "')")
+            sys.exit(PROGRAM_ERRORS)
+    return strftime("%Y%m%d %H%M%S", gmtime())
+
+
 def is_power_of_2(x):
     """Determine if a number is a power of 2"""
     return ((x != 0) and not(x & (x - 1)))
@@ -68,9 +92,151 @@ def next_boundary(location, block_size):
     return (location + (block_size - 1)) & ~(block_size - 1)
 
 
-def is_constant_fill(bytes, fill_byte):
-    """Check a range of bytes for a constant fill"""
-    return all(b == fill_byte for b in bytes)
+# Single-byte strings for each byte value (see: is_constant_fill)
+fill_bytes = [pack("B", b) for b in range(256)]
+
+
+def is_constant_fill(data, fill_byte):
+    """Check a range of bytes for a constant fill
+
+    data may be a bytearray, bytes (e.g., an mmap slice), memoryview or
+    buffer. The fill bytes are counted in C rather than compared one by one
+    in Python, so checking whole erase blocks or images is cheap.
+    """
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    elif not isinstance(data, (bytes, bytearray)):
+        # (e.g., a Python 2 buffer)
+        data = bytes(data)
+    return data.count(fill_bytes[fill_byte]) == len(data)
+
+
+def find_collisions(extents):
+    """Find all overlapping pairs in a list of extents
+
+    extents is a list of (start, end) tuples, where end is the (inclusive)
+    last location of the extent. Returns a list (parallel to extents) of
+    sorted lists of the indices of the other extents with which each one
+    overlaps.
+
+    This is a sweep over the extents sorted by start, keeping a heap of
+    the "open" extents ordered by end, so it runs in O(n log n + k) (for
+    k collisions) rather than comparing every pair.
+    """
+    collisions = [[] for _ in extents]
+    open_extents = []
+    for index in sorted(range(len(extents)), key=lambda i: extents[i]):
+        start, end = extents[index]
+        # Retire the extents which end before this one starts; since we
+        # visit the extents in order of start, they can't overlap any
+        # which follow either.
+        while open_extents and open_extents[0][0] < start:
+            heapq.heappop(open_extents)
+        for other_end, other in open_extents:
+            other_start = extents[other][0]
+            if other_end >= start and other_start <= end:
+                collisions[index].append(other)
+                collisions[other].append(index)
+        heapq.heappush(open_extents, (end, index))
+    for collision in collisions:
+        collision.sort()
+    return collisions
+
+
+def buffer_view(buf):
+    """Return a zero-copy view of a buffer
+
+    Returns a memoryview over buf if it supports the buffer protocol (e.g.,
+    bytearray), so that slicing and struct decoding don't copy the data.
+    Objects which only support the old-style buffer interface (e.g., mmap)
+    are returned as-is, since struct can already decode from them in place.
+    """
+    if isinstance(buf, memoryview):
+        return buf
+    try:
+        return memoryview(buf)
+    except TypeError:
+        return buf
+
+
+def buffer_slice(buf, start, length):
+    """Return a zero-copy slice of a buffer (see: buffer_view)"""
+    view = buffer_view(buf)
+    if isinstance(view, memoryview):
+        return view[start:start + length]
+    # Old-style buffer (e.g., mmap under Python 2)
+    return buffer(view, start, length)
+
+
+def header_string(field):
+    """Convert a fixed-length (NUL-padded) header string field to text"""
+    if not field:
+        return u""
+    if isinstance(field, bytes):
+        field = field.decode("ascii", "replace")
+    return field.rstrip(u"\0")
+
+
+def parallel_map(function, items, jobs=None, initializer=None, initargs=()):
+    """Apply a function to each of a list of items, in parallel
+
+    The items are processed by a pool of jobs processes (default: one per
+    CPU), and the results are yielded in the order of the items, as they
+    become available. function must be a module-level function, and the
+    items and results must be picklable.
+
+    If given, initializer(*initargs) is called once in each process which
+    processes items (including this one, if they're processed serially),
+    e.g. to set up per-process state which can't be pickled.
+    """
+    # (multiprocessing is only imported when it's needed, since it adds
+    # noticeably to the start-up time of every tool)
+    import multiprocessing
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(items))
+    if jobs <= 1:
+        if initializer and items:
+            initializer(*initargs)
+        for item in items:
+            yield function(item)
+        return
+
+    pool = multiprocessing.Pool(jobs, initializer, initargs)
+    try:
+        chunk_size = max(1, min(64, len(items) // (4 * jobs)))
+        for result in pool.imap(function, items, chunk_size):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def print_json(records, json_lines=False):
+    """Print a sequence of records (dictionaries) as JSON
+
+    The records are printed as they arrive, either as a JSON list or, if
+    json_lines is True, as JSON Lines (one record per line). Returns the
+    number of records which report an error (i.e., have an "error" key).
+    """
+    num_errors = 0
+    separator = "[\n"
+    for record in records:
+        if "error" in record:
+            num_errors += 1
+        if json_lines:
+            # (Finish each line as it's written, for consumers reading line
+            # by line)
+            sys.stdout.write(json.dumps(record, sort_keys=True) + "\n")
+        else:
+            sys.stdout.write(separator +
+                             json.dumps(record, sort_keys=True, indent=2,
+                                        separators=(",", ": ")))
+            separator = ",\n"
+        sys.stdout.flush()
+    if not json_lines:
+        sys.stdout.write("[]\n" if separator == "[\n" else "\n]\n")
+    return num_errors
 
 
 def display_binary_data(blob, show_all, indent=""):